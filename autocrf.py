@@ -0,0 +1,151 @@
+import os
+import re
+import shutil
+import tempfile
+from cache import JsonCache, file_key
+from scheduler import cpu_count, thread_args, run_command, gather_limited
+
+SAMPLE_COUNT = 4
+SAMPLE_SECONDS = 4
+CRF_RANGE = (16, 40)
+DEFAULT_TARGET = "ssim:0.98"
+
+ssim_pattern = re.compile(r'SSIM .*All:\s*([\d.]+)')
+psnr_pattern = re.compile(r'PSNR .*average:\s*([\d.]+|inf)')
+
+_crf_cache = None
+
+
+def get_crf_cache():
+    global _crf_cache
+    if _crf_cache is None:
+        _crf_cache = JsonCache("crf_search.json")
+    return _crf_cache
+
+
+def parse_target(text):
+    # "ssim:0.98", "psnr:42" or "size:250" (megabytes)
+    kind, _, value = (text or DEFAULT_TARGET).partition(":")
+    kind = kind.strip().lower()
+    if kind not in ("ssim", "psnr", "size"):
+        raise ValueError(f"Unknown auto CRF target: {text}")
+    value = float(value)
+    if kind == "size":
+        value = value * 1024 * 1024
+    return kind, value
+
+
+def sample_starts(duration, count=SAMPLE_COUNT, length=SAMPLE_SECONDS):
+    if duration <= length * count:
+        return [0.0]
+    return [max(0.0, duration * (n + 1) / (count + 1) - length / 2) for n in range(count)]
+
+
+class CrfSearch:
+    def __init__(self, input_file, info, target=DEFAULT_TARGET, preset="slow", ffmpegcmd="ffmpeg", log=None):
+        self.input_file = input_file
+        self.info = info
+        self.kind, self.value = parse_target(target)
+        self.preset = preset
+        self.ffmpegcmd = ffmpegcmd
+        self.log = log or (lambda message: None)
+        self.starts = sample_starts(info["duration"])
+        self.length = min(SAMPLE_SECONDS, info["duration"]) or SAMPLE_SECONDS
+        self.cache_key = f"{file_key(input_file)}|{preset}|{len(self.starts)}x{self.length}"
+        self.results = get_crf_cache().get(self.cache_key) or {}
+
+    async def encode_sample(self, work_dir, start, crf, threads, jobs):
+        decode_args, encode_args = thread_args(threads, jobs)
+        sample_file = os.path.join(work_dir, f"sample_{crf}_{start:.3f}.mkv")
+        encode = [
+            self.ffmpegcmd, "-hide_banner", "-v", "error", *decode_args, "-ss", f"{start:.3f}", "-t", f"{self.length:.3f}",
+            "-i", self.input_file, "-an", "-sn", "-vcodec", "libx265", "-crf", str(crf), "-preset", self.preset,
+            *encode_args, "-y", sample_file
+        ]
+        returncode, _, _ = await run_command(encode)
+        if returncode != 0:
+            return None
+
+        size = os.path.getsize(sample_file)
+        if self.kind == "size":
+            return size, None, None
+
+        # Both sides are decoded from the same accurate seek, so the frames line up
+        score = [
+            self.ffmpegcmd, "-hide_banner", "-i", sample_file, "-ss", f"{start:.3f}", "-t", f"{self.length:.3f}",
+            "-i", self.input_file, "-lavfi",
+            "[0:v]setpts=PTS-STARTPTS,split[d1][d2];[1:v]setpts=PTS-STARTPTS,split[r1][r2];[d1][r1]ssim;[d2][r2]psnr",
+            "-f", "null", "-"
+        ]
+        _, _, stderr = await run_command(score)
+        ssim = ssim_pattern.search(stderr)
+        psnr = psnr_pattern.search(stderr)
+        if not ssim or not psnr:
+            return None
+        return size, float(ssim.group(1)), float(psnr.group(1))
+
+    async def measure(self, crf):
+        cached = self.results.get(str(crf))
+        if cached and (self.kind == "size" or cached.get(self.kind) is not None):
+            return cached
+
+        jobs = len(self.starts)
+        threads = max(1, cpu_count() // jobs)
+        work_dir = tempfile.mkdtemp(prefix="krrsnk-crf-")
+        try:
+            samples = await gather_limited(
+                [self.encode_sample(work_dir, start, crf, threads, jobs) for start in self.starts], jobs
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if any(sample is None for sample in samples):
+            return None
+
+        measured = {
+            "bytes_per_second": sum(sample[0] for sample in samples) / (self.length * len(samples)),
+            "ssim": None if self.kind == "size" else min(sample[1] for sample in samples),
+            "psnr": None if self.kind == "size" else min(sample[2] for sample in samples),
+        }
+        self.results[str(crf)] = measured
+        get_crf_cache().set(self.cache_key, self.results)
+        return measured
+
+    def estimated_size(self, measured):
+        duration = self.info["duration"]
+        return measured["bytes_per_second"] * duration + self.info["audio_bit_rate"] * duration / 8
+
+    def meets(self, measured):
+        if self.kind == "size":
+            return self.estimated_size(measured) <= self.value
+        return measured[self.kind] >= self.value
+
+    async def run(self):
+        # Quality drops and size shrinks as CRF goes up: for a quality target we want
+        # the highest CRF that still passes, for a size target the lowest one that fits
+        low, high = CRF_RANGE
+        best = None
+        while low <= high:
+            crf = (low + high) // 2
+            measured = await self.measure(crf)
+            if measured is None:
+                self.log(f"Auto CRF: sample encode failed for {self.input_file}.")
+                return None
+            passed = self.meets(measured)
+            self.log(f"Auto CRF: CRF {crf} {'meets' if passed else 'misses'} the {self.kind} target for {self.input_file}")
+            if passed:
+                best = crf
+            if passed == (self.kind != "size"):
+                low = crf + 1
+            else:
+                high = crf - 1
+
+        if best is None:
+            best = CRF_RANGE[0] if self.kind != "size" else CRF_RANGE[1]
+            self.log(f"Auto CRF: no CRF in {CRF_RANGE[0]}-{CRF_RANGE[1]} meets the target for {self.input_file}, using {best}.")
+        return best
+
+
+async def estimate_size(input_file, info, crf_value, preset="slow", ffmpegcmd="ffmpeg"):
+    search = CrfSearch(input_file, info, "size:0", preset, ffmpegcmd)
+    measured = await search.measure(crf_value)
+    return search.estimated_size(measured) if measured else None
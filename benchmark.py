@@ -0,0 +1,394 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cache import cache_dir, read_json, write_json_atomic
+from probe import probe_video, count_stream
+from progress import FFmpegProcess, describe_progress
+from scheduler import run_command, cpu_count
+from engine import CompressionEngine
+
+try:
+    import resource
+except ImportError:
+    # Windows, CPU time is reported as null there
+    resource = None
+
+SOURCES = {
+    "testsrc2": "testsrc2=size={w}x{h}:rate=30",
+    "mandelbrot": "mandelbrot=size={w}x{h}:rate=30",
+}
+SIZES = [(640, 360), (1280, 720), (1920, 1080)]
+DURATIONS = [2, 10]
+QUICK_CASES = [("testsrc2", 640, 360, 2)]
+PROGRESS_BLOCKS = 20000
+DEFAULT_TOLERANCE = 0.10
+# Wall time differences below this are mostly process startup noise
+MIN_SECONDS = 0.05
+# Cold start of compressQT until the window is shown, in seconds
+STARTUP_TARGET = 1.0
+# The stand-in releases endpoint answers this late, like a hanging proxy
+STAND_IN_DELAY = 10.0
+
+STARTUP_SCRIPT = """
+import os, time
+started = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+import compressQT
+app = QApplication([])
+window = compressQT.CompressorApp()
+window.show()
+app.processEvents()
+print(time.perf_counter() - started, flush=True)
+# Don't wait for the update check, it is the part that must not hold startup back
+os._exit(0)
+"""
+
+# Metrics compared against the baseline, True when higher is better
+METRICS = {
+    "wall_time": False,
+    "cpu_time": False,
+    "peak_rss_kb": False,
+    "window_shown": False,
+    "fps": True,
+    "output_size": False,
+    "us_per_block": False,
+}
+
+
+def case_name(source, width, height, duration):
+    return f"{source}-{width}x{height}-{duration}s"
+
+
+def all_cases():
+    # Smallest first
+    return [
+        (source, width, height, duration)
+        for width, height in SIZES
+        for duration in DURATIONS
+        for source in SOURCES
+    ]
+
+
+def cpu_usage():
+    if resource is None:
+        return None
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return children.ru_utime + children.ru_stime + own.ru_utime + own.ru_stime
+
+
+class PeakRss:
+    # Metrics sink for the engine, keeps the largest max RSS ffmpeg reported with -benchmark.
+    # RUSAGE_CHILDREN can't be used, it is the peak of every child the benchmark ever had.
+    def __init__(self):
+        self.peak_kb = 0
+
+    def record(self, job):
+        self.peak_kb = max(self.peak_kb, job.max_rss_kb)
+
+
+async def measure(stage, repeat=1):
+    # Runs the stage and keeps the fastest run
+    best = None
+    for _ in range(max(1, repeat)):
+        before = cpu_usage()
+        start = time.perf_counter()
+        extra = await stage()
+        wall_time = time.perf_counter() - start
+        after = cpu_usage()
+        # Only stages that run ffmpeg through the engine know their peak RSS
+        result = {
+            "wall_time": round(wall_time, 4),
+            "cpu_time": round(after - before, 4) if after is not None else None,
+            "peak_rss_kb": None,
+        }
+        result.update(extra or {})
+        if best is None or result["wall_time"] < best["wall_time"]:
+            best = result
+    return best
+
+
+async def generate_input(path, source, width, height, duration, ffmpegcmd):
+    if os.path.exists(path):
+        return
+    # Bit-exact flags keep the same input byte for byte across runs of the same ffmpeg
+    command = [
+        ffmpegcmd, "-hide_banner", "-v", "error",
+        "-f", "lavfi", "-i", SOURCES[source].format(w=width, h=height),
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000", "-t", str(duration),
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", "60",
+        "-c:a", "aac", "-map_metadata", "-1",
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        "-y", path + ".tmp.mp4"
+    ]
+    returncode, _, stderr = await run_command(command)
+    if returncode != 0:
+        raise RuntimeError(f"could not generate {path}: {stderr.strip()}")
+    os.replace(path + ".tmp.mp4", path)
+
+
+def progress_blob(blocks):
+    lines = []
+    for n in range(blocks):
+        lines.append(
+            f"frame={n}\nfps=30.00\nstream_0_0_q=28.0\nbitrate=1234.5kbits/s\ntotal_size={n * 4096}\n"
+            f"out_time_us={n * 33333}\nout_time_ms={n * 33333}\nout_time=00:00:00.000000\n"
+            f"dup_frames=0\ndrop_frames=0\nspeed=1.23x\nprogress={'end' if n == blocks - 1 else 'continue'}\n"
+        )
+    return "".join(lines).encode("ascii")
+
+
+class StandInReleases:
+    # Local replacement for the GitHub releases API
+    def __init__(self, delay=STAND_IN_DELAY):
+        self.delay = delay
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/releases/latest"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handler(self):
+        delay = self.delay
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(delay)
+                body = json.dumps({"name": "v0.0.0"}).encode("utf-8")
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Benchmark:
+    def __init__(self, work_dir, ffmpegcmd="ffmpeg", ffprobecmd="ffprobe", preset="ultrafast", job_counts=None, repeat=1, log=print):
+        self.work_dir = work_dir
+        self.input_dir = os.path.join(work_dir, "inputs")
+        self.output_dir = os.path.join(work_dir, "outputs")
+        self.ffmpegcmd = ffmpegcmd
+        self.ffprobecmd = ffprobecmd
+        self.preset = preset
+        self.job_counts = job_counts or sorted({1, 2, cpu_count()})
+        self.repeat = repeat
+        self.log = log
+
+    async def prepare(self, cases):
+        os.makedirs(self.input_dir, exist_ok=True)
+        paths = {}
+        for case in cases:
+            path = os.path.join(self.input_dir, case_name(*case) + ".mp4")
+            self.log(f"Preparing {os.path.basename(path)}")
+            await generate_input(path, *case, self.ffmpegcmd)
+            paths[case_name(*case)] = path
+        return paths
+
+    async def bench_probe(self, input_file):
+        async def stage():
+            info = await probe_video(input_file, self.ffprobecmd, use_cache=False)
+            return {"frames": info["frames"], "frames_source": info["frames_source"]}
+        return await measure(stage, self.repeat)
+
+    async def bench_probe_decode(self, input_file):
+        # Worst case of the probe, when neither metadata nor packets give a frame count
+        async def stage():
+            return {"frames": await count_stream(input_file, self.ffprobecmd, "frames")}
+        return await measure(stage, self.repeat)
+
+    async def encode(self, input_files, jobs):
+        if os.path.isdir(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.makedirs(self.output_dir)
+        output_files = [os.path.join(self.output_dir, os.path.basename(input_file)) for input_file in input_files]
+        peak = PeakRss()
+        engine = CompressionEngine(
+            20, self.preset, self.ffmpegcmd, self.ffprobecmd, jobs=jobs, always_encode=True, metrics=peak
+        )
+        results = await engine.run_batch(input_files, output_files)
+        if not all(result.ok for result in results):
+            raise RuntimeError(f"encode failed for {', '.join(r.input_file for r in results if not r.ok)}")
+        return {"output_size": sum(result.compressed_size for result in results), "peak_rss_kb": peak.peak_kb or None}
+
+    async def bench_encode(self, input_file, frames):
+        async def stage():
+            return await self.encode([input_file], 1)
+        result = await measure(stage, self.repeat)
+        result["fps"] = round(frames / result["wall_time"], 2) if result["wall_time"] else None
+        return result
+
+    async def bench_batch(self, input_files, frames, jobs):
+        async def stage():
+            return {**await self.encode(input_files, jobs), "files": len(input_files)}
+        result = await measure(stage, self.repeat)
+        result["fps"] = round(frames / result["wall_time"], 2) if result["wall_time"] else None
+        return result
+
+    async def bench_progress(self, blocks=PROGRESS_BLOCKS):
+        # Feeds canned -progress output through the same reader the encodes use
+        blob = progress_blob(blocks)
+
+        async def stage():
+            reader = asyncio.StreamReader()
+            reader.feed_data(blob)
+            reader.feed_eof()
+            process = FFmpegProcess([self.ffmpegcmd], lambda event: describe_progress(event, blocks, blocks / 30))
+            await process.read_progress(reader)
+            return {"blocks": blocks}
+        result = await measure(stage, self.repeat)
+        result["us_per_block"] = round(result["wall_time"] / blocks * 1e6, 3)
+        return result
+
+    async def bench_startup(self):
+        # Fresh cache dir every run, so the update check is never answered from disk
+        releases = StandInReleases()
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+
+        async def stage():
+            with tempfile.TemporaryDirectory() as cache:
+                env = dict(os.environ, QT_QPA_PLATFORM="offscreen", KRRSNK_RELEASES_URL=releases.url, KRRSNK_CACHE_DIR=cache)
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, "-c", STARTUP_SCRIPT, cwd=app_dir, env=env,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"compressQT failed to start: {stderr.decode(errors='replace').strip()}")
+            return {"window_shown": round(float(stdout), 4)}
+        try:
+            return await measure(stage, self.repeat)
+        finally:
+            releases.close()
+
+    async def run(self, cases):
+        paths = await self.prepare(cases)
+        results = {"progress": await self.bench_progress()}
+        if importlib.util.find_spec("PyQt6"):
+            self.log("Benchmarking compressQT startup")
+            results["startup/compressQT"] = await self.bench_startup()
+        else:
+            self.log("PyQt6 is not installed, skipping the startup benchmark")
+
+        frames = {}
+        for name, path in paths.items():
+            self.log(f"Benchmarking {name}")
+            probe = await self.bench_probe(path)
+            frames[name] = probe["frames"]
+            results[f"{name}/probe"] = probe
+            results[f"{name}/probe_decode"] = await self.bench_probe_decode(path)
+            results[f"{name}/encode"] = await self.bench_encode(path, frames[name])
+
+        for jobs in self.job_counts:
+            self.log(f"Benchmarking batch with {jobs} job(s)")
+            results[f"batch/jobs={jobs}"] = await self.bench_batch(list(paths.values()), sum(frames.values()), jobs)
+
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        return results
+
+
+async def ffmpeg_version(ffmpegcmd):
+    _, stdout, _ = await run_command([ffmpegcmd, "-version"])
+    return stdout.splitlines()[0] if stdout else ""
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            if metric in ("wall_time", "cpu_time", "fps") and abs(current["wall_time"] - previous["wall_time"]) < MIN_SECONDS:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{key} {metric}: {old} -> {new} ({change * 100:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compression pipeline on generated test videos.")
+    parser.add_argument('--ffmpeg', type=str, default="ffmpeg", help="Path to the ffmpeg executable.")
+    parser.add_argument('--ffprobe', type=str, default="ffprobe", help="Path to the ffprobe executable.")
+    parser.add_argument('--preset', type=str, default="ultrafast", help="x265 preset used for the encode benchmarks.")
+    parser.add_argument('--quick', action='store_true', help="Only run one small case (for CI smoke runs).")
+    parser.add_argument('--jobs', type=str, help="Comma-separated job counts for the batch benchmark (default 1, 2 and the core count).")
+    parser.add_argument('--repeat', type=int, default=1, help="Run every stage this many times and keep the fastest run.")
+    parser.add_argument('--work-dir', type=str, default=os.path.join(cache_dir(), "benchmark"), help="Where test inputs are generated and kept between runs.")
+    parser.add_argument('--output', type=str, default="benchmark.json", help="Where to write the results.")
+    parser.add_argument('--baseline', type=str, help="Results of an earlier run to compare against.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="Relative change that counts as a regression (0.10 = 10%%).")
+    parser.add_argument('--save-baseline', action='store_true', help="Also write the results to --baseline.")
+    parser.add_argument('--startup-target', type=float, default=STARTUP_TARGET, help="Seconds compressQT may take to show its window.")
+
+    args = parser.parse_args()
+    job_counts = [int(jobs) for jobs in args.jobs.split(',')] if args.jobs else None
+    cases = QUICK_CASES if args.quick else all_cases()
+
+    benchmark = Benchmark(args.work_dir, args.ffmpeg, args.ffprobe, args.preset, job_counts, args.repeat)
+    try:
+        results = asyncio.run(benchmark.run(cases))
+        version = asyncio.run(ffmpeg_version(args.ffmpeg))
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": cpu_count(),
+        "ffmpeg": version,
+        "preset": args.preset,
+        "results": results,
+    }
+    write_json_atomic(args.output, report)
+    print(f"Results written to {args.output}")
+
+    startup = results.get("startup/compressQT")
+    # window_shown leaves out the interpreter startup, which the app can't do anything about
+    if startup and startup["window_shown"] > args.startup_target:
+        print(f"Regression: compressQT took {startup['window_shown']}s to show its window (target {args.startup_target}s)")
+        sys.exit(1)
+
+    if not args.baseline:
+        return
+    baseline = read_json(args.baseline)
+    if args.save_baseline or baseline is None:
+        write_json_atomic(args.baseline, report)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if baseline.get("ffmpeg") != version or baseline.get("cpu_count") != cpu_count():
+        print("Warning: the baseline was recorded with a different ffmpeg or CPU count.")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for line in regressions:
+        print(f"Regression: {line}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
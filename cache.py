@@ -0,0 +1,71 @@
+import os
+import json
+import tempfile
+import threading
+
+
+def cache_dir():
+    base = os.environ.get("KRRSNK_CACHE_DIR")
+    if not base:
+        root = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        base = os.path.join(root, "krrsnk-video-compressor")
+    os.makedirs(base, exist_ok=True)
+    return base
+
+
+def write_json_atomic(path, data):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class JsonCache:
+    def __init__(self, name, path=None):
+        self.path = path or os.path.join(cache_dir(), name)
+        self.lock = threading.Lock()
+        self.data = None
+
+    def _load(self):
+        if self.data is None:
+            data = read_json(self.path, {})
+            self.data = data if isinstance(data, dict) else {}
+        return self.data
+
+    def get(self, key):
+        with self.lock:
+            return self._load().get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            data = self._load()
+            # Pick up entries written by other processes since we loaded
+            on_disk = read_json(self.path, {})
+            if isinstance(on_disk, dict):
+                on_disk.update(data)
+                data = self.data = on_disk
+            data[key] = value
+            try:
+                write_json_atomic(self.path, data)
+            except OSError:
+                pass
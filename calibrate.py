@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import platform
+from cache import cache_dir, write_json_atomic
+from scheduler import cpu_count, thread_args, run_command, gather_limited
+from autocrf import ssim_pattern
+from benchmark import generate_input, ffmpeg_version
+from presets import PRESETS, PROFILE_VERSION, profile_path
+
+CLIP = ("mandelbrot", 1280, 720, 4)
+CLIP_RATE = 30
+CALIBRATION_CRF = 23
+QUICK_PRESETS = ["ultrafast", "veryfast", "medium", "slow"]
+
+
+def job_layouts(cores=None):
+    # One encode with every core, then several smaller ones side by side
+    cores = cores or cpu_count()
+    return [jobs for jobs in (1, 2, 4, 8) if jobs <= cores]
+
+
+class Calibration:
+    def __init__(self, work_dir, ffmpegcmd="ffmpeg", presets=None, job_counts=None, log=print):
+        self.work_dir = work_dir
+        self.ffmpegcmd = ffmpegcmd
+        self.presets = presets or PRESETS
+        self.job_counts = job_counts or job_layouts()
+        self.log = log
+        self.source, self.width, self.height, self.duration = CLIP
+        self.clip = os.path.join(work_dir, f"calibration-{self.source}-{self.width}x{self.height}.mp4")
+        self.frames = self.duration * CLIP_RATE
+
+    async def encode(self, preset, index, threads, jobs):
+        decode_args, encode_args = thread_args(threads, jobs)
+        x265_params = ":".join(encode_args[1:] + ["log-level=error"])
+        output_file = os.path.join(self.work_dir, f"out-{index}.mkv")
+        command = [
+            self.ffmpegcmd, "-hide_banner", "-v", "error", *decode_args, "-i", self.clip, "-an",
+            "-vcodec", "libx265", "-crf", str(CALIBRATION_CRF), "-preset", preset,
+            "-x265-params", x265_params, "-y", output_file
+        ]
+        returncode, _, stderr = await run_command(command)
+        if returncode != 0:
+            raise RuntimeError(f"x265 {preset} failed: {stderr.strip()}")
+        return output_file
+
+    async def ssim(self, output_file):
+        command = [
+            self.ffmpegcmd, "-hide_banner", "-i", output_file, "-i", self.clip,
+            "-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"
+        ]
+        _, _, stderr = await run_command(command)
+        match = ssim_pattern.search(stderr)
+        return float(match.group(1)) if match else None
+
+    async def measure(self, preset, jobs):
+        # The same clip encoded by `jobs` ffmpegs at once, each with its share of the cores
+        threads = max(1, cpu_count() // jobs)
+        started = time.perf_counter()
+        outputs = await gather_limited([self.encode(preset, n, threads, jobs) for n in range(jobs)], jobs)
+        wall_time = time.perf_counter() - started
+        fps = self.frames * jobs / wall_time
+        entry = {
+            "preset": preset, "jobs": jobs, "threads": threads,
+            "fps": round(fps, 2), "speed": round(fps / CLIP_RATE, 3),
+            "kbps": round(os.path.getsize(outputs[0]) * 8 / self.duration / 1000, 1),
+        }
+        # Quality only depends on the preset, threads barely change it
+        if jobs == self.job_counts[0]:
+            entry["ssim"] = await self.ssim(outputs[0])
+        for output_file in outputs:
+            os.remove(output_file)
+        return entry
+
+    async def run(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.log(f"Preparing {os.path.basename(self.clip)}")
+        await generate_input(self.clip, self.source, self.width, self.height, self.duration, self.ffmpegcmd)
+
+        entries = []
+        for preset in self.presets:
+            ssim = None
+            for jobs in self.job_counts:
+                entry = await self.measure(preset, jobs)
+                ssim = entry.setdefault("ssim", ssim)
+                entries.append(entry)
+                self.log(f"{preset:>9} {jobs} job(s) x {entry['threads']} threads: {entry['fps']:7.2f} fps, "
+                         f"{entry['speed']:.2f}x real time, {entry['kbps']} kbps, SSIM {entry['ssim']}")
+        return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how fast each x265 preset runs on this machine.")
+    parser.add_argument('--ffmpeg', type=str, default="ffmpeg", help="Path to the ffmpeg executable.")
+    parser.add_argument('--presets', type=str, help="Comma-separated presets to calibrate (default all of them).")
+    parser.add_argument('--jobs', type=str, help="Comma-separated parallel job counts to calibrate (default 1, 2, 4, 8 up to the core count).")
+    parser.add_argument('--quick', action='store_true', help="Only calibrate a few presets.")
+    parser.add_argument('--work-dir', type=str, default=os.path.join(cache_dir(), "calibration"), help="Where the calibration clip is generated.")
+    parser.add_argument('--output', type=str, default=profile_path(), help="Where to write the profile (the compressor reads the default location).")
+
+    args = parser.parse_args()
+    presets = args.presets.split(',') if args.presets else QUICK_PRESETS if args.quick else PRESETS
+    unknown = [preset for preset in presets if preset not in PRESETS]
+    if unknown:
+        parser.error(f"unknown preset(s): {', '.join(unknown)}")
+    job_counts = sorted(int(jobs) for jobs in args.jobs.split(',')) if args.jobs else None
+
+    calibration = Calibration(args.work_dir, args.ffmpeg, presets, job_counts)
+    try:
+        entries = asyncio.run(calibration.run())
+        version = asyncio.run(ffmpeg_version(args.ffmpeg))
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+
+    profile = {
+        "version": PROFILE_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "ffmpeg": version,
+        "clip": {"source": calibration.source, "width": calibration.width, "height": calibration.height,
+                 "duration": calibration.duration, "fps": CLIP_RATE, "crf": CALIBRATION_CRF},
+        "entries": entries,
+    }
+    write_json_atomic(args.output, profile)
+    print(f"Profile written to {args.output}")
+
+if __name__ == "__main__":
+    main()
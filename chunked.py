@@ -0,0 +1,190 @@
+import os
+import re
+import shutil
+import tempfile
+from probe import to_float
+from scheduler import cpu_count, useful_threads, thread_args, run_command, gather_limited
+from progress import FFmpegProcess
+
+MIN_SEGMENT_SECONDS = 30
+SCENE_THRESHOLD = 0.4
+# How close (in seconds) a keyframe has to be to a scene cut to count as one
+SCENE_SNAP_SECONDS = 0.5
+
+scene_pattern = re.compile(r'pts_time:\s*(\d+(?:\.\d+)?)')
+
+
+async def get_keyframes(input_file, ffprobecmd):
+    # Reads packet flags only, nothing is decoded
+    command = [
+        ffprobecmd, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", input_file
+    ]
+    _, stdout, _ = await run_command(command)
+    keyframes = []
+    for line in stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(to_float(pts_time))
+    return sorted(set(keyframes))
+
+
+async def get_scene_cuts(input_file, ffmpegcmd, threshold=SCENE_THRESHOLD):
+    # Scene detection needs a decode, do it on a small picture to keep it cheap
+    command = [
+        ffmpegcmd, "-hide_banner", "-i", input_file, "-an", "-sn",
+        "-vf", f"scale=320:-2,select='gt(scene,{threshold})',showinfo", "-f", "null", "-"
+    ]
+    _, _, stderr = await run_command(command)
+    return [float(match.group(1)) for match in scene_pattern.finditer(stderr)]
+
+
+def pick_boundaries(candidates, duration, segments, min_length=MIN_SEGMENT_SECONDS):
+    boundaries = []
+    last = 0.0
+    for n in range(1, segments):
+        target = duration * n / segments
+        best = min(
+            (time for time in candidates if time - last >= min_length and duration - time >= min_length),
+            key=lambda time: abs(time - target), default=None
+        )
+        if best is not None and best > last:
+            boundaries.append(best)
+            last = best
+    return boundaries
+
+
+def encoded_name(segment):
+    return f"encoded_{segment:04d}.mp4"
+
+
+def segment_command(ffmpegcmd, source_file, output_file, crf_value, preset="slow", decode_args=(), encode_args=()):
+    # Video only, the audio is copied from the original file when the segments are joined
+    return [
+        ffmpegcmd, *decode_args, "-i", source_file,
+        "-vcodec", "libx265", "-crf", str(crf_value), "-preset", preset, *encode_args,
+        "-fps_mode", "passthrough", "-an", "-y", output_file
+    ]
+
+
+class ChunkedEncoder:
+    def __init__(self, input_file, output_file, info, crf_value, preset="slow", ffmpegcmd="ffmpeg", ffprobecmd="ffprobe",
+                 split_mode="keyframe", log=None, progress=None, on_exit=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.info = info
+        self.crf_value = crf_value
+        self.preset = preset
+        self.ffmpegcmd = ffmpegcmd
+        self.ffprobecmd = ffprobecmd
+        self.split_mode = split_mode
+        self.log = log or (lambda message: None)
+        self.progress = progress or (lambda current, total: None)
+        self.on_exit = on_exit
+        self.segment_frames = {}
+
+    def plan(self):
+        cores = cpu_count()
+        threads = max(2, useful_threads(self.info["height"]) // 4)
+        workers = max(1, cores // threads)
+        segments = min(workers * 2, int(self.info["duration"] // MIN_SEGMENT_SECONDS))
+        return workers, max(1, cores // workers), segments
+
+    async def split_points(self, segments):
+        candidates = await get_keyframes(self.input_file, self.ffprobecmd)
+        if self.split_mode == "scene":
+            cuts = await get_scene_cuts(self.input_file, self.ffmpegcmd)
+            scene_keyframes = [time for time in candidates if any(abs(time - cut) <= SCENE_SNAP_SECONDS for cut in cuts)]
+            if len(scene_keyframes) >= segments - 1:
+                candidates = scene_keyframes
+            else:
+                self.log(f"Not enough scene cuts on keyframes in {self.input_file}, splitting at keyframes instead.")
+        return pick_boundaries(candidates, self.info["duration"], segments)
+
+    async def run_ffmpeg(self, command, segment=None):
+        def on_progress(event):
+            if segment is None:
+                return
+            self.segment_frames[segment] = event.frame
+            current = sum(self.segment_frames.values())
+            if self.info["frames"]:
+                self.progress(min(current, self.info["frames"]), self.info["frames"])
+
+        process = FFmpegProcess(command, on_progress, on_exit=self.on_exit)
+        if await process.run() != 0:
+            for line in process.tail():
+                self.log(f"  {line}")
+        return process.returncode
+
+    async def run(self):
+        # None means the file can't be split, the caller compresses it as a whole
+        workers, threads, segments = self.plan()
+        if segments < 2:
+            self.log(f"{self.input_file} is too short to split.")
+            return None
+
+        boundaries = await self.split_points(segments)
+        if not boundaries:
+            self.log(f"No keyframes far enough apart to split {self.input_file} on.")
+            return None
+
+        work_dir = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(os.path.abspath(self.output_file)))
+        try:
+            return await self.encode_segments(work_dir, boundaries, workers, threads)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def encode_segments(self, work_dir, boundaries, workers, threads):
+        self.log(f"Splitting {self.input_file} into {len(boundaries) + 1} segments, {workers} encoded at once")
+        sources = await self.split(work_dir, boundaries)
+        if sources is None:
+            return False
+
+        decode_args, encode_args = thread_args(threads, workers)
+
+        async def encode(segment, name):
+            command = segment_command(
+                self.ffmpegcmd, os.path.join(work_dir, name), os.path.join(work_dir, encoded_name(segment)),
+                self.crf_value, self.preset, decode_args, encode_args
+            )
+            return await self.run_ffmpeg(command, segment)
+
+        results = await gather_limited([encode(segment, name) for segment, name in enumerate(sources)], workers)
+        if any(code != 0 for code in results):
+            self.log(f"Error: Encoding of a segment failed for {self.input_file}.")
+            return False
+
+        if not await self.join(work_dir, len(sources)):
+            return False
+        if self.info["frames"]:
+            self.progress(self.info["frames"], self.info["frames"])
+        return True
+
+    async def split(self, work_dir, boundaries):
+        # Boundaries are exact keyframe times, so a stream copy split is frame exact.
+        # Nudge them down a little so rounding can't push a cut to the next keyframe.
+        split_command = [
+            self.ffmpegcmd, "-i", self.input_file, "-map", "0:v:0", "-c", "copy",
+            "-f", "segment", "-segment_times", ",".join(f"{max(0.0, time - 0.001):.6f}" for time in boundaries),
+            "-reset_timestamps", "1", "-segment_format", "nut", "-y", os.path.join(work_dir, "source_%04d.nut")
+        ]
+        if await self.run_ffmpeg(split_command) != 0:
+            self.log(f"Error: Splitting failed for {self.input_file}.")
+            return None
+        return sorted(name for name in os.listdir(work_dir) if name.startswith("source_"))
+
+    async def join(self, work_dir, count):
+        # Expects encoded_NNNN.mp4 for every segment in work_dir
+        list_file = os.path.join(work_dir, "segments.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            for segment in range(count):
+                f.write(f"file '{encoded_name(segment)}'\n")
+
+        concat_command = [
+            self.ffmpegcmd, "-f", "concat", "-safe", "0", "-i", list_file, "-i", self.input_file,
+            "-map", "0:v", "-map", "1:a?", "-c", "copy", "-y", self.output_file
+        ]
+        if await self.run_ffmpeg(concat_command) != 0:
+            self.log(f"Error: Joining segments failed for {self.input_file}.")
+            return False
+        return True
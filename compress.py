@@ -1,90 +1,251 @@
 import os
-import subprocess
-import json
-import re
+import sys
+import asyncio
 import argparse
+from engine import CompressionEngine, LOG, COMPLETE, output_path, is_stream, LOOKAHEAD, PROBE_JOBS, PROBE_NICE, PROBE_IO
+from scheduler import IO_PRIORITIES
+from presets import PRESETS, load_profile, parse_speed, parse_deadline
+from ladder import parse_ladder
+from governor import Governor, parse_size, parse_cpus, CHECK_SECONDS
+from watcher import WatchDaemon, SETTLE_SECONDS, QUEUE_SIZE
+from autocrf import DEFAULT_TARGET, parse_target
+from manifest import Manifest
+from metrics import MetricsWriter
+from distributed import Coordinator, Worker
 
 class VideoCompressor:
-    def __init__(self, input_files, output_files, crf_value):
+    def __init__(self, input_files, output_files, engine, retry_failed=False):
+        # The engine carries every encoding option, main() builds it from the arguments
         self.input_files = input_files
         self.output_files = output_files
-        self.crf_value = crf_value
+        self.retry_failed = retry_failed
+        self.engine = engine
 
     def run(self):
-        for idx, (input_file, output_file) in enumerate(zip(self.input_files, self.output_files)):
-            total_frames = self.get_total_frames(input_file)
-            if total_frames == 0:
-                print(f"Compression aborted for {input_file}: Unable to retrieve frame count.")
-                continue
-
-            command = [
-                "ffmpeg", "-i", input_file,
-                "-vcodec", "libx265", "-crf", str(self.crf_value), "-preset", "slow",
-                "-acodec", "copy", "-y", output_file
-            ]
-
-            print(f"Starting compression for {input_file} with CRF value: {self.crf_value}")
-
-            process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-            frame_pattern = re.compile(r'frame=\s*(\d+)')
-
-            while process.poll() is None:
-                line = process.stderr.readline()
-                match = frame_pattern.search(line)
-
-                if match:
-                    current_frame = int(match.group(1))
-                    print(f"File {idx+1}/{len(self.input_files)} - Current frame: {current_frame}/{total_frames}")
-
-            process.communicate()
-
-            if process.returncode != 0:
-                print(f"Error: Compression failed for {input_file}.")
-                continue
-
-            compressed_size = os.path.getsize(output_file)
-            original_size = os.path.getsize(input_file)
-            compression_pct = (1 - compressed_size / original_size) * 100
-            print(f"File {idx+1} compressed successfully!")
-            print(f"Compressed file: {output_file}")
-            print(f"Compressed size: {compressed_size / (1024 * 1024):.2f} MB")
-            print(f"Compression rate: {round(compression_pct, 2)}%")
-            print("======================")
-
-    def get_total_frames(self, input_file):
-        print(f"Getting total frames of the video {input_file}...")
-        command = [
-            "ffprobe", "-v", "error", "-select_streams", "v:0",
-            "-count_frames", "-show_entries", "stream=nb_read_frames",
-            "-of", "json", input_file
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        printer = asyncio.create_task(self.print_events(self.engine.subscribe()))
+        try:
+            await self.engine.run_batch(self.input_files, self.output_files, self.retry_failed)
+        finally:
+            self.engine.close()
+            await printer
+        if self.engine.failed:
+            print("Run again with --retry-failed to retry the failed files.")
+
+    def stream(self):
+        return asyncio.run(self.stream_async())
+
+    async def stream_async(self):
+        # stdout may be carrying the video, everything else goes to stderr
+        printer = asyncio.create_task(self.print_events(self.engine.subscribe(), sys.stderr))
+        try:
+            result = await self.engine.stream_file(self.input_files[0], self.output_files[0])
+        finally:
+            self.engine.close()
+            await printer
+        return result.ok
+
+    def watch(self, watch_folder, output_folder, settle=SETTLE_SECONDS, queue_size=QUEUE_SIZE):
+        asyncio.run(self.watch_async(watch_folder, output_folder, settle, queue_size))
+
+    async def watch_async(self, watch_folder, output_folder, settle, queue_size):
+        printer = asyncio.create_task(self.print_events(self.engine.subscribe()))
+        daemon = WatchDaemon(
+            self.engine, watch_folder, output_folder, lambda input_file: output_path(input_file, output_folder),
+            queue_size, settle, log=self.engine.log
+        )
         try:
-            probe_data = json.loads(result.stdout)
-            return int(probe_data["streams"][0]["nb_read_frames"])
-        except (KeyError, IndexError, json.JSONDecodeError):
-            print(f"Failed to get total frames for {input_file}.")
-            return 0
+            await daemon.run()
+        finally:
+            self.engine.close()
+            await printer
+
+    async def print_events(self, events, file=None):
+        async for event in events:
+            if event.kind == LOG:
+                print(event.message, file=file)
+            elif event.kind == COMPLETE:
+                print(f"File {event.idx+1} compressed successfully!\n"
+                      f"Compressed file: {event.output_file}\n"
+                      f"Compressed size: {event.compressed_size / (1024 * 1024):.2f} MB\n"
+                      f"Compression rate: {round(event.compression_pct, 2)}%\n"
+                      f"Action: {event.action} ({event.reason})\n"
+                      "======================", file=file)
 
 def main():
     parser = argparse.ArgumentParser(description="Compress video files using FFmpeg.")
-    parser.add_argument('--input', type=str, required=True, help="Semicolon-separated list of input video files.")
-    parser.add_argument('--output', type=str, required=True, help="Output folder for compressed videos.")
-    parser.add_argument('--crf', type=int, required=True, help="CRF value (0-51) for compression quality.")
+    parser.add_argument('--input', type=str, help="Semicolon-separated list of input video files, or - / a named pipe to stream.")
+    parser.add_argument('--watch', type=str, help="Keep running and compress every video that appears in this folder.")
+    parser.add_argument('--watch-settle', type=float, default=SETTLE_SECONDS, help="Seconds a new file must stay unchanged before it is picked up.")
+    parser.add_argument('--watch-queue', type=int, default=QUEUE_SIZE, help="How many settled files may wait for an encoder before the watcher holds back.")
+    parser.add_argument('--output', type=str, help="Output folder for compressed videos, or - / a named pipe to stream fragmented MP4 to.")
+    parser.add_argument('--crf', type=str, help="CRF value (0-51) for compression quality, or \"auto\" to search for it on sample clips.")
+    parser.add_argument('--target-size', type=float, help="Target output size in MB, encodes with two-pass x265 instead of CRF.")
+    parser.add_argument('--auto-target', type=str, default=DEFAULT_TARGET, help="Target for --crf auto: ssim:<score>, psnr:<dB> or size:<MB>.")
+    parser.add_argument('--always-encode', action='store_true', help="Re-encode every input, even ones that are already efficiently encoded.")
+    parser.add_argument('--skip-efficient', action='store_true', help="Skip already efficiently encoded inputs instead of remuxing them.")
+    parser.add_argument('--preset', choices=PRESETS, default="slow", help="x265 preset, slower ones compress better.")
+    parser.add_argument('--speed', type=str, help="Pick the slowest preset that still encodes at this speed, e.g. 1.5x real time (needs calibrate.py).")
+    parser.add_argument('--deadline', type=str, help="Pick the slowest preset that finishes the batch in time, e.g. 90m or 2h (needs calibrate.py).")
+    parser.add_argument('--ladder', type=str, help="Make several renditions from one decode, e.g. \"1080:20,720:22,480:24\" (height:CRF[:name suffix]).")
+    parser.add_argument('--jobs', type=int, default=0, help="Number of files compressed at once (0 = pick from CPU cores and resolution).")
+    parser.add_argument('--chunked', action='store_true', help="Split each video into segments and encode them in parallel (for long videos).")
+    parser.add_argument('--split', choices=['keyframe', 'scene'], default='keyframe', help="Where chunked mode splits the video.")
+    parser.add_argument('--incremental', action='store_true', help="Skip inputs that are unchanged since the last run into the same output folder.")
+    parser.add_argument('--retry-failed', action='store_true', help="When resuming an interrupted batch, also retry the files that failed.")
+    parser.add_argument('--lookahead', type=int, default=LOOKAHEAD, help="How many upcoming files are probed in the background while encoding (0 = probe everything before starting).")
+    parser.add_argument('--probe-jobs', type=int, default=PROBE_JOBS, help="How many upcoming files are probed at once.")
+    parser.add_argument('--probe-nice', type=int, default=PROBE_NICE, help="Niceness of the background probes (0 = same priority as the encodes).")
+    parser.add_argument('--probe-io', choices=list(IO_PRIORITIES), default=PROBE_IO, help="I/O priority of the background probes (Linux, needs ionice).")
+    parser.add_argument('--preread', action='store_true', help="Also load upcoming files into the page cache (helps with network or spinning disks).")
+    parser.add_argument('--decide-ahead', action='store_true', help="Also run the encode/remux/skip decision for upcoming files in the background.")
+    parser.add_argument('--nice', type=int, default=0, help="Niceness of the encodes (0 = normal priority).")
+    parser.add_argument('--ionice', choices=list(IO_PRIORITIES), default="normal", help="I/O priority of the encodes (Linux, needs ionice).")
+    parser.add_argument('--cpus', type=str, help="Only use these CPUs, e.g. 0-3,6 (Linux).")
+    parser.add_argument('--cpu-max', type=float, help="Cap all encodes together at this many cores (Linux, cgroup v2).")
+    parser.add_argument('--memory-max', type=str, help="Cap the memory of the encodes, e.g. 4G (cgroup v2, otherwise per ffmpeg with RLIMIT_AS).")
+    parser.add_argument('--max-load', type=float, help="Run fewer jobs at once while the load average per core is above this.")
+    parser.add_argument('--min-free-disk', type=str, help="Pause the encodes while the output folder has less free space than this, e.g. 10G.")
+    parser.add_argument('--governor-interval', type=float, default=CHECK_SECONDS, help="Seconds between load and free space checks.")
+    parser.add_argument('--ffmpeg', type=str, default="ffmpeg", help="Path to the ffmpeg executable.")
+    parser.add_argument('--ffprobe', type=str, default="ffprobe", help="Path to the ffprobe executable.")
+    parser.add_argument('--coordinator', type=str, help="Hand the --input files out to workers instead of encoding them here, listening on HOST:PORT.")
+    parser.add_argument('--segments', action='store_true', help="With --coordinator, split long files into keyframe-aligned segments so several workers share one file.")
+    parser.add_argument('--worker', type=str, help="Run as a worker for the coordinator at this URL (e.g. http://10.0.0.5:8765).")
+    parser.add_argument('--token', type=str, help="Shared secret between the coordinator and its workers.")
+    parser.add_argument('--metrics-jsonl', type=str, help="Append a JSON record per job (timings, fps, sizes, exit code) to this file.")
+    parser.add_argument('--metrics-textfile', type=str, help="Keep batch totals in Prometheus text format in this file.")
+    parser.add_argument('--metrics-port', type=int, help="Serve batch totals in Prometheus text format on http://127.0.0.1:PORT/metrics.")
 
     args = parser.parse_args()
 
-    input_files = args.input.split(';')
+    if args.worker:
+        if not Worker(args.worker, token=args.token, ffmpegcmd=args.ffmpeg, ffprobecmd=args.ffprobe, log=print).start():
+            sys.exit(1)
+        return
+    # Streaming compresses one input straight into the output, without a folder or temp files
+    streaming = is_stream(args.input or "") or is_stream(args.output or "")
+    if not args.output and not streaming:
+        parser.error("--output is required")
+    if not args.input and not args.watch:
+        parser.error("either --input or --watch is required")
+    input_files = args.input.split(';') if args.input else []
     output_folder = args.output
-    crf_value = args.crf
-
-    output_files = [
-        os.path.join(output_folder, f"{os.path.splitext(os.path.basename(input_file))[0]}_compressed.mp4")
-        for input_file in input_files
-    ]
-
-    compressor = VideoCompressor(input_files, output_files, crf_value)
-    compressor.run()
+    if args.crf is None and not args.target_size and not args.ladder:
+        parser.error("either --crf or --target-size is required")
+    crf_value = None
+    if args.crf is not None:
+        try:
+            crf_value = args.crf.lower() if args.crf.lower() == "auto" else int(args.crf)
+        except ValueError:
+            parser.error(f"invalid --crf: {args.crf} (expected 0-51 or auto)")
+    target_size = int(args.target_size * 1024 * 1024) if args.target_size else None
+    try:
+        parse_target(args.auto_target)
+    except ValueError:
+        parser.error(f"invalid --auto-target: {args.auto_target}")
+
+    ladder = None
+    if args.ladder:
+        # Every rendition has its own fixed CRF, there is no per-rendition search
+        if target_size or args.chunked or args.coordinator or crf_value == "auto":
+            parser.error("--ladder doesn't work with --target-size, --crf auto, --chunked or --coordinator")
+        try:
+            ladder = parse_ladder(args.ladder, crf_value if isinstance(crf_value, int) else None)
+        except ValueError as e:
+            parser.error(f"invalid --ladder: {e}")
+
+    speed = deadline = profile = None
+    try:
+        speed = parse_speed(args.speed) if args.speed else None
+        deadline = parse_deadline(args.deadline) if args.deadline else None
+    except ValueError as e:
+        parser.error(str(e))
+    if speed and deadline:
+        parser.error("use either --speed or --deadline")
+    if speed or deadline:
+        profile = load_profile()
+        if profile is None:
+            parser.error("no calibration profile for this machine, run calibrate.py first")
+
+    if streaming:
+        if len(input_files) != 1 or args.watch or args.coordinator or args.incremental:
+            parser.error("streaming takes exactly one --input and no --watch, --coordinator or --incremental")
+        if crf_value in (None, "auto") or target_size or args.chunked or speed or deadline or ladder:
+            parser.error("streaming needs a fixed --crf, and no --target-size, --chunked, --speed, --deadline or --ladder")
+        if not args.output or is_stream(args.output):
+            output_files = [args.output or "-"]
+        else:
+            # Only the input is a stream, --output is still a folder like in every other mode
+            os.makedirs(output_folder, exist_ok=True)
+            output_files = [output_path("stdin" if input_files[0] == "-" else input_files[0], output_folder)]
+    else:
+        output_files = [output_path(input_file, output_folder) for input_file in input_files]
+
+    if args.coordinator:
+        if args.segments and (crf_value in (None, "auto") or target_size):
+            parser.error("--segments needs a fixed --crf, every segment must be encoded the same way")
+        host, _, port = args.coordinator.rpartition(":")
+        if not port.isdigit():
+            parser.error(f"invalid --coordinator: {args.coordinator} (expected HOST:PORT)")
+        settings = {
+            "crf": crf_value if crf_value in (None, "auto") else max(0, min(51, crf_value)), "preset": args.preset,
+            "auto_target": args.auto_target, "target_size": target_size,
+            "always_encode": args.always_encode, "skip_efficient": args.skip_efficient,
+        }
+        coordinator = Coordinator(
+            input_files, output_files, settings, host or "127.0.0.1", int(port), args.token, args.segments,
+            args.ffmpeg, args.ffprobe, args.retry_failed, log=print
+        )
+        try:
+            ok = coordinator.start()
+        except OSError as e:
+            parser.error(f"can't start the coordinator: {e}")
+        if not ok:
+            print("Run again with --retry-failed to retry the failed files.")
+        return
+
+    governor = None
+    if args.nice or args.ionice != "normal" or args.cpus or args.cpu_max or args.memory_max or args.max_load or args.min_free_disk:
+        try:
+            governor = Governor(
+                args.nice, args.ionice, parse_cpus(args.cpus) if args.cpus else None, args.cpu_max,
+                parse_size(args.memory_max) if args.memory_max else None, args.max_load,
+                parse_size(args.min_free_disk) if args.min_free_disk else None, args.governor_interval
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Watch mode relies on the manifest to skip what a previous run already finished
+    manifest = Manifest(output_folder) if args.incremental or args.watch else None
+    metrics = None
+    if args.metrics_jsonl or args.metrics_textfile or args.metrics_port:
+        try:
+            metrics = MetricsWriter(args.metrics_jsonl, args.metrics_textfile, args.metrics_port)
+        except OSError as e:
+            parser.error(f"can't set up metrics output: {e}")
+    engine = CompressionEngine(
+        crf_value, args.preset, ffmpegcmd=args.ffmpeg, ffprobecmd=args.ffprobe, jobs=args.jobs, chunked=args.chunked,
+        split_mode=args.split, auto_target=args.auto_target, target_size=target_size,
+        always_encode=args.always_encode, skip_efficient=args.skip_efficient, manifest=manifest, metrics=metrics,
+        lookahead=args.lookahead, probe_jobs=args.probe_jobs, probe_nice=args.probe_nice, probe_io=args.probe_io,
+        preread=args.preread, decide_ahead=args.decide_ahead, speed=speed, deadline=deadline, profile=profile,
+        ladder=ladder, governor=governor
+    )
+    compressor = VideoCompressor(input_files, output_files, engine, args.retry_failed)
+    try:
+        if streaming:
+            if not compressor.stream():
+                sys.exit(1)
+        elif args.watch:
+            compressor.watch(args.watch, output_folder, args.watch_settle, args.watch_queue)
+        else:
+            compressor.run()
+    finally:
+        if metrics:
+            metrics.close()
 
 if __name__ == "__main__":
     main()
@@ -1,75 +1,37 @@
 import os
-import subprocess
-import json
-import re
+import asyncio
 import humanize
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from threading import Thread
+from engine import CompressionEngine, forward_events
+from autocrf import DEFAULT_TARGET
+from progress_bus import ProgressBus, new_log_path, VISIBLE_LOG_LINES, FLUSH_INTERVAL
 
 class VideoCompressor(Thread):
-    def __init__(self, input_files, output_files, crf_value, progress_callback, log_callback, complete_callback):
+    def __init__(self, input_files, output_files, crf_value, progress_callback, log_callback, complete_callback, jobs=None, chunked=False, split_mode="keyframe", retry_failed=False, auto_target=DEFAULT_TARGET):
         super().__init__()
         self.input_files = input_files
         self.output_files = output_files
-        self.crf_value = crf_value
         self.progress_callback = progress_callback
         self.log_callback = log_callback
         self.complete_callback = complete_callback
+        self.retry_failed = retry_failed
+        self.engine = CompressionEngine(crf_value, jobs=jobs, chunked=chunked, split_mode=split_mode, auto_target=auto_target)
 
     def run(self):
-        for idx, (input_file, output_file) in enumerate(zip(self.input_files, self.output_files)):
-            total_frames = self.get_total_frames(input_file)
-            if total_frames == 0:
-                self.log_callback(f"Compression aborted for {input_file}: Unable to retrieve frame count.")
-                continue
-
-            command = [
-                "ffmpeg", "-i", input_file,
-                "-vcodec", "libx265", "-crf", str(self.crf_value), "-preset", "slow",
-                "-acodec", "copy", "-y", output_file
-            ]
-
-            self.log_callback(f"Starting compression for {input_file} with CRF value: {self.crf_value}")
-            
-            process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-            frame_pattern = re.compile(r'frame=\s*(\d+)')
-
-            while process.poll() is None:
-                line = process.stderr.readline()
-                match = frame_pattern.search(line)
-                
-                if match:
-                    current_frame = int(match.group(1))
-                    self.progress_callback(current_frame, total_frames, idx)
-                    self.log_callback(f"File {idx+1}/{len(self.input_files)} - Current frame: {current_frame}/{total_frames}")
-            
-            process.communicate()
-
-            if process.returncode != 0:
-                self.log_callback(f"Error: Compression failed for {input_file}.")
-                continue
-
-            compressed_size = os.path.getsize(output_file)
-            original_size = os.path.getsize(input_file)
-            
-            compression_pct = (1 - compressed_size / original_size) * 100
-            self.complete_callback(output_file, compressed_size, compression_pct, idx)
-
-    def get_total_frames(self, input_file):
-        self.log_callback(f"Getting total frames of the video {input_file}...")
-        command = [
-            "ffprobe", "-v", "error", "-select_streams", "v:0",
-            "-count_frames", "-show_entries", "stream=nb_read_frames",
-            "-of", "json", input_file
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # The engine gets its own event loop on this thread, Tk keeps the main one
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        forward = asyncio.create_task(forward_events(
+            self.engine.subscribe(), self.progress_callback, self.log_callback, self.complete_callback
+        ))
         try:
-            probe_data = json.loads(result.stdout)
-            return int(probe_data["streams"][0]["nb_read_frames"])
-        except (KeyError, IndexError, json.JSONDecodeError):
-            self.log_callback(f"Failed to get total frames for {input_file}.")
-            return 0
+            await self.engine.run_batch(self.input_files, self.output_files, self.retry_failed)
+        finally:
+            self.engine.close()
+            await forward
 
 
 class CompressorApp(tk.Tk):
@@ -87,13 +49,24 @@ class CompressorApp(tk.Tk):
         self.browse_button = tk.Button(self, text="Browse Files", command=self.browse_files)
         self.browse_button.pack()
 
-        self.crf_label = tk.Label(self, text="CRF Value (0-51):")
+        self.crf_label = tk.Label(self, text="CRF Value (0-51 or auto):")
         self.crf_label.pack()
 
         self.crf_value = tk.Entry(self)
         self.crf_value.insert(0, "20")
         self.crf_value.pack()
 
+        self.jobs_label = tk.Label(self, text="Parallel Jobs (0 = auto):")
+        self.jobs_label.pack()
+
+        self.jobs_value = tk.Entry(self)
+        self.jobs_value.insert(0, "0")
+        self.jobs_value.pack()
+
+        self.chunked_value = tk.BooleanVar(value=False)
+        self.chunked_check = tk.Checkbutton(self, text="Split long videos into segments and encode them in parallel", variable=self.chunked_value)
+        self.chunked_check.pack()
+
         self.output_label = tk.Label(self, text="Output Folder:")
         self.output_label.pack()
 
@@ -127,7 +100,11 @@ class CompressorApp(tk.Tk):
     def log_status(self, message):
         self.status_log.config(state=tk.NORMAL)
         self.status_log.insert(tk.END, message + '\n')
+        lines = int(self.status_log.index('end-1c').split('.')[0]) - 1
+        if lines > VISIBLE_LOG_LINES:
+            self.status_log.delete('1.0', f'{lines - VISIBLE_LOG_LINES + 1}.0')
         self.status_log.config(state=tk.DISABLED)
+        self.status_log.see(tk.END)
 
     def clear_logs_and_progress(self):
         self.status_log.config(state=tk.NORMAL)
@@ -148,7 +125,17 @@ class CompressorApp(tk.Tk):
 
     def start_compression(self):
         input_files = self.input_path.get().split(';')
-        crf_value = int(self.crf_value.get())
+        crf_value = self.crf_value.get().strip().lower()
+        jobs = self.jobs_value.get().strip() or "0"
+        if crf_value != "auto" and not crf_value.isdigit():
+            messagebox.showwarning("Input Error", "CRF Value must be a number from 0 to 51 or \"auto\".")
+            return
+        if not jobs.isdigit():
+            messagebox.showwarning("Input Error", "Parallel Jobs must be a whole number, 0 picks it automatically.")
+            return
+        crf_value = crf_value if crf_value == "auto" else int(crf_value)
+        jobs = int(jobs)
+        chunked = self.chunked_value.get()
         output_folder = self.output_path.get()
 
         if not input_files or not output_folder:
@@ -171,11 +158,30 @@ class CompressorApp(tk.Tk):
             self.progress_bars.append(progress_bar)
             self.progress_labels.append(label)
 
+        # The worker only talks to the bus, the UI picks batches up on its own thread
+        self.bus = ProgressBus(new_log_path())
+        self.log_status(f"Full log: {self.bus.log_path}")
         self.compressor_thread = VideoCompressor(
             input_files, output_files, crf_value,
-            self.update_progress, self.log_status, self.compression_complete
+            self.bus.progress, self.bus.log, self.bus.complete, jobs, chunked, retry_failed=True
         )
         self.compressor_thread.start()
+        self.after(int(FLUSH_INTERVAL * 1000), self.poll_bus)
+
+    def poll_bus(self):
+        running = self.compressor_thread.is_alive()
+        progress, logs, complete = self.bus.drain()
+        for idx, (current, total) in progress.items():
+            self.update_progress(current, total, idx)
+        if logs:
+            self.log_status("\n".join(logs))
+        for args in complete:
+            self.compression_complete(*args)
+
+        if running:
+            self.after(int(FLUSH_INTERVAL * 1000), self.poll_bus)
+        else:
+            self.bus.close()
 
     def compression_complete(self, output_file, compressed_size, compression_pct, idx):
         self.log_status(f"File {idx+1} compressed successfully!")
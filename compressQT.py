@@ -1,102 +1,79 @@
 import os
-import subprocess
-import json
-import re
-import humanize
 from PyQt6.QtWidgets import (QApplication, QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, 
-                             QProgressBar, QTextEdit, QFileDialog, QMessageBox, QMenuBar, QMainWindow)
+                             QProgressBar, QPlainTextEdit, QFileDialog, QMessageBox, QMenuBar, QMainWindow, QCheckBox)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtGui import QIcon, QAction
-import requests
-import webbrowser
+from progress_bus import ProgressBus, new_log_path, VISIBLE_LOG_LINES
+from updates import is_latest, RELEASES_PAGE, CHECK_INTERVAL
 
+# The engine (asyncio, ffmpeg helpers), humanize and webbrowser are imported on
+# first use, so the window shows up without waiting for them.
 
 CURRENT_VERSION = "0.1.1"
-def check_updates():
-    try:
-        response = requests.get("https://api.github.com/repos/kararasenok-gd/krrsnk-video-compressor/releases/latest")
-        response.raise_for_status()
-        latest_release = response.json()
-        return latest_release["name"] == f"v{CURRENT_VERSION}"
-    except Exception as e:
-        return False
+
+class UpdateChecker(QThread):
+    result_signal = pyqtSignal(object)
+
+    def __init__(self, max_age=CHECK_INTERVAL):
+        super().__init__()
+        self.max_age = max_age
+
+    def run(self):
+        self.result_signal.emit(is_latest(CURRENT_VERSION, max_age=self.max_age))
 
 class VideoCompressor(QThread):
     progress_signal = pyqtSignal(int, int, int)
     log_signal = pyqtSignal(str)
     complete_signal = pyqtSignal(str, int, float, int)
 
-    def __init__(self, input_files, output_files, crf_value, ffmpegcmd, ffprobecmd):
+    def __init__(self, input_files, output_files, crf_value, ffmpegcmd, ffprobecmd, jobs=None, chunked=False, split_mode="keyframe", retry_failed=False, auto_target=None):
         super().__init__()
+        from engine import CompressionEngine
+        from autocrf import DEFAULT_TARGET
         self.input_files = input_files
         self.output_files = output_files
-        self.crf_value = crf_value
-        self.ffmpegcmd = ffmpegcmd
-        self.ffprobecmd = ffprobecmd
-        
-        if self.crf_value < 0:
-            self.crf_value = 0
-        elif self.crf_value > 51:
-            self.crf_value = 51
+        self.bus = ProgressBus(new_log_path())
+        self.retry_failed = retry_failed
+        # The engine clamps CRF to 0-51
+        self.engine = CompressionEngine(
+            crf_value, ffmpegcmd=ffmpegcmd, ffprobecmd=ffprobecmd, jobs=jobs, chunked=chunked,
+            split_mode=split_mode, auto_target=auto_target or DEFAULT_TARGET
+        )
 
     def run(self):
-        for idx, (input_file, output_file) in enumerate(zip(self.input_files, self.output_files)):
-            total_frames = self.get_total_frames(input_file)
-            if total_frames == 0:
-                self.log_signal.emit(f"Compression aborted for {input_file}: Unable to retrieve frame count.")
-                continue
-
-            command = [
-                self.ffmpegcmd, "-i", input_file,
-                "-vcodec", "libx265", "-crf", str(self.crf_value), "-preset", "slow",
-                "-acodec", "copy", "-y", output_file
-            ]
-
-            self.log_signal.emit(f"Starting compression for {input_file} with CRF value: {self.crf_value}")
-            
-            process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-            frame_pattern = re.compile(r'frame=\s*(\d+)')
-
-            while process.poll() is None:
-                line = process.stderr.readline()
-                match = frame_pattern.search(line)
-                
-                if match:
-                    current_frame = int(match.group(1))
-                    self.progress_signal.emit(current_frame, total_frames, idx)
-                    self.log_signal.emit(f"File {idx+1}/{len(self.input_files)} - Current frame: {current_frame}/{total_frames}")
-            
-            process.communicate()
-
-            if process.returncode != 0:
-                self.log_signal.emit(f"Error: Compression failed for {input_file}.")
-                continue
-
-            compressed_size = os.path.getsize(output_file)
-            original_size = os.path.getsize(input_file)
-            
-            compression_pct = (1 - compressed_size / original_size) * 100
-            self.complete_signal.emit(output_file, compressed_size, compression_pct, idx)
-
-    def get_total_frames(self, input_file):
-        self.log_signal.emit(f"Getting total frames of the video {input_file}...")
-        command = [
-            self.ffprobecmd, "-v", "error", "-select_streams", "v:0",
-            "-count_frames", "-show_entries", "stream=nb_read_frames",
-            "-of", "json", input_file
-        ]
-        
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        import asyncio
+        self.bus.start(self.deliver)
+        try:
+            self.bus.log(f"Full log: {self.bus.log_path}")
+            asyncio.run(self.compress_all())
+        finally:
+            self.bus.close()
+
+    def deliver(self, progress, logs, complete):
+        # Called from the bus flusher thread, signals are queued to the UI thread
+        for idx, (current, total) in progress.items():
+            self.progress_signal.emit(current, total, idx)
+        if logs:
+            self.log_signal.emit("\n".join(logs))
+        for args in complete:
+            self.complete_signal.emit(*args)
+
+    async def compress_all(self):
+        import asyncio
+        from engine import forward_events
+        forward = asyncio.create_task(forward_events(
+            self.engine.subscribe(), self.bus.progress, self.bus.log, self.bus.complete
+        ))
         try:
-            probe_data = json.loads(result.stdout)
-            return int(probe_data["streams"][0]["nb_read_frames"])
-        except (KeyError, IndexError, json.JSONDecodeError):
-            self.log_signal.emit(f"Failed to get total frames for {input_file}.")
-            return 0
+            await self.engine.run_batch(self.input_files, self.output_files, self.retry_failed)
+        finally:
+            self.engine.close()
+            await forward
 
 class CompressorApp(QMainWindow):
     def __init__(self):
         super().__init__()
+        self.update_checker = None
         self.init_ui()
         self.check_update(showIfLatest=False)
 
@@ -111,9 +88,13 @@ class CompressorApp(QMainWindow):
         self.browse_button = QPushButton("Browse Files")
         self.browse_button.clicked.connect(self.browse_files)
 
-        self.crf_label = QLabel("CRF Value (0-51):")
+        self.crf_label = QLabel("CRF Value (0-51 or auto):")
         self.crf_value = QLineEdit("20")
 
+        self.jobs_label = QLabel("Parallel Jobs (0 = auto):")
+        self.jobs_value = QLineEdit("0")
+        self.chunked_check = QCheckBox("Split long videos into segments and encode them in parallel")
+
         self.output_label = QLabel("Output Folder:")
         self.output_path = QLineEdit()
         self.browse_output_button = QPushButton("Browse Output Folder")
@@ -127,8 +108,9 @@ class CompressorApp(QMainWindow):
         
         self.progress_bars = []
         self.progress_labels = []
-        self.status_log = QTextEdit()
+        self.status_log = QPlainTextEdit()
         self.status_log.setReadOnly(True)
+        self.status_log.setMaximumBlockCount(VISIBLE_LOG_LINES)
 
         self.compress_button = QPushButton("Compress")
         self.compress_button.clicked.connect(self.start_compression)
@@ -139,6 +121,9 @@ class CompressorApp(QMainWindow):
         layout.addWidget(self.browse_button)
         layout.addWidget(self.crf_label)
         layout.addWidget(self.crf_value)
+        layout.addWidget(self.jobs_label)
+        layout.addWidget(self.jobs_value)
+        layout.addWidget(self.chunked_check)
         layout.addWidget(self.output_label)
         layout.addWidget(self.output_path)
         layout.addWidget(self.browse_output_button)
@@ -168,7 +153,19 @@ class CompressorApp(QMainWindow):
         self.check_update()
         
     def check_update(self, showIfLatest=True):
-        if not check_updates():
+        # Runs in the background, the answer comes back to show_update_result
+        if self.update_checker and self.update_checker.isRunning():
+            return
+        # Startup reuses an answer from the last day, the menu action always asks again
+        self.update_checker = UpdateChecker(0 if showIfLatest else CHECK_INTERVAL)
+        self.update_checker.result_signal.connect(lambda latest: self.show_update_result(latest, showIfLatest))
+        self.update_checker.start()
+
+    def show_update_result(self, latest, showIfLatest):
+        if latest is None:
+            if showIfLatest:
+                QMessageBox.warning(self, "Information", "Couldn't check for updates, please try again later.")
+        elif not latest:
             msgbox = QMessageBox.question(
                 self,
                 "Information",
@@ -177,13 +174,20 @@ class CompressorApp(QMainWindow):
             )
             
             if msgbox == QMessageBox.StandardButton.Yes:
-                webbrowser.open("https://github.com/kararasenok-gd/krrsnk-video-compressor/releases/latest")
+                import webbrowser
+                webbrowser.open(RELEASES_PAGE)
         else:
             if showIfLatest:
                 QMessageBox.information(self, "Information", "You already have the latest version!")
         
+    def closeEvent(self, event):
+        # Bounded by the check timeout, a running QThread can't be destroyed
+        if self.update_checker:
+            self.update_checker.wait()
+        super().closeEvent(event)
+
     def show_info(self):
-        QMessageBox.information(self, "Information", f"KRRSNK Video Compressor v{CURRENT_VERSION}\nCreated by kararasenok_gd\n\nInputs:\nVideo File - File to compress\nCRF Value - how to compress a file. The higher the value, the worse the quality.\nOutput folder - folder, where located compressed file\nFFMPEG Command - FFMpeg command. Can be just ffmpeg (if FFMpeg bin folder in PATH variable) or path to ffmpeg.exe\nFFPROBE Command - same, but with FFProbe")
+        QMessageBox.information(self, "Information", f"KRRSNK Video Compressor v{CURRENT_VERSION}\nCreated by kararasenok_gd\n\nInputs:\nVideo File - File to compress\nCRF Value - how to compress a file. The higher the value, the worse the quality. \"auto\" picks the highest CRF that keeps SSIM at 0.98 or more, from a few sample clips\nParallel Jobs - how many files are compressed at once, 0 picks it from CPU cores and resolution\nSplit long videos - encode segments of one video in parallel, useful for a single long file\nOutput folder - folder, where located compressed file\nFFMPEG Command - FFMpeg command. Can be just ffmpeg (if FFMpeg bin folder in PATH variable) or path to ffmpeg.exe\nFFPROBE Command - same, but with FFProbe")
 
     def browse_files(self):
         file_dialog = QFileDialog(self)
@@ -198,7 +202,7 @@ class CompressorApp(QMainWindow):
             self.output_path.setText(folder_path)
 
     def log_status(self, message):
-        self.status_log.append(message)
+        self.status_log.appendPlainText(message)
 
     def clear_logs_and_progress(self):
         self.status_log.clear()
@@ -219,7 +223,17 @@ class CompressorApp(QMainWindow):
 
     def start_compression(self):
         input_files = self.input_path.text().split(';')
-        crf_value = int(self.crf_value.text())
+        crf_value = self.crf_value.text().strip().lower()
+        jobs = self.jobs_value.text().strip() or "0"
+        if crf_value != "auto" and not crf_value.isdigit():
+            QMessageBox.warning(self, "Input Error", "CRF Value must be a number from 0 to 51 or \"auto\".")
+            return
+        if not jobs.isdigit():
+            QMessageBox.warning(self, "Input Error", "Parallel Jobs must be a whole number, 0 picks it automatically.")
+            return
+        crf_value = crf_value if crf_value == "auto" else int(crf_value)
+        jobs = int(jobs)
+        chunked = self.chunked_check.isChecked()
         output_folder = self.output_path.text()
         ffmpegRunCMD = self.ffmpegcommandInput.text()
         ffprobeRunCMD = self.ffprobecommandInput.text()
@@ -244,13 +258,14 @@ class CompressorApp(QMainWindow):
             self.progress_bars.append(progress_bar)
             self.progress_labels.append(label)
 
-        self.compressor_thread = VideoCompressor(input_files, output_files, crf_value, ffmpegRunCMD, ffprobeRunCMD)
+        self.compressor_thread = VideoCompressor(input_files, output_files, crf_value, ffmpegRunCMD, ffprobeRunCMD, jobs, chunked, retry_failed=True)
         self.compressor_thread.progress_signal.connect(self.update_progress)
         self.compressor_thread.log_signal.connect(self.log_status)
         self.compressor_thread.complete_signal.connect(self.compression_complete)
         self.compressor_thread.start()
 
     def compression_complete(self, output_file, compressed_size, compression_pct, idx):
+        import humanize
         self.log_status(f"File {idx+1} compressed successfully!")
         self.log_status(f"Compressed file: {output_file}")
         self.log_status(f"Compressed size: {humanize.naturalsize(compressed_size)}")
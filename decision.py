@@ -0,0 +1,43 @@
+ENCODE = "encode"
+REMUX = "remux"
+SKIP = "skip"
+
+EFFICIENT_CODECS = ("hevc", "av1", "vp9")
+# Bits per pixel below which an efficient codec has nothing left to give,
+# and above which any input is clearly worth re-encoding
+LOW_BITS_PER_PIXEL = 0.04
+HIGH_BITS_PER_PIXEL = 0.10
+# Re-encode only if the sample estimate saves at least this share of the size
+MIN_SAVING = 0.10
+
+
+def bits_per_pixel(info):
+    bit_rate = info["video_bit_rate"] or max(0, info["bit_rate"] - info["audio_bit_rate"])
+    pixels = info["width"] * info["height"] * info["fps"]
+    return bit_rate / pixels if bit_rate and pixels else 0.0
+
+
+async def decide(info, crf_value=None, target_size=None, estimate=None, skip_efficient=False):
+    keep = SKIP if skip_efficient else REMUX
+
+    if target_size:
+        if info["size"] and info["size"] <= target_size:
+            return keep, f"already {info['size'] / (1024 * 1024):.2f} MB, under the target size"
+        return ENCODE, "over the target size"
+
+    bpp = bits_per_pixel(info)
+    codec = info["codec"] or "unknown codec"
+    if not bpp:
+        return ENCODE, f"{codec}, bitrate unknown"
+    if info["codec"] in EFFICIENT_CODECS and bpp <= LOW_BITS_PER_PIXEL:
+        return keep, f"already {codec} at {bpp:.3f} bits/pixel"
+    if bpp >= HIGH_BITS_PER_PIXEL or crf_value is None or estimate is None:
+        return ENCODE, f"{codec} at {bpp:.3f} bits/pixel"
+
+    estimated = await estimate()
+    if not estimated or not info["size"]:
+        return ENCODE, f"{codec} at {bpp:.3f} bits/pixel"
+    saving = 1 - estimated / info["size"]
+    if saving < MIN_SAVING:
+        return keep, f"sample encode at CRF {crf_value} saves only {saving * 100:.1f}%"
+    return ENCODE, f"sample encode at CRF {crf_value} saves about {saving * 100:.1f}%"
@@ -0,0 +1,613 @@
+import os
+import hmac
+import json
+import time
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from probe import probe_video
+from progress import FFmpegProcess
+from chunked import ChunkedEncoder, segment_command, encoded_name
+from engine import CompressionEngine, forward_events
+from decision import SKIP
+from jobqueue import JobQueue, DONE, FAILED, temp_output_path, commit_output, discard
+
+HEARTBEAT_SECONDS = 5
+# A leased task goes back to the queue after this long without a heartbeat
+LEASE_TIMEOUT = 30
+MAX_ATTEMPTS = 3
+# Rough segment length when files are split for the workers
+SEGMENT_SECONDS = 120
+POLL_SECONDS = 2
+COPY_CHUNK = 1 << 20
+
+PENDING = "pending"
+LEASED = "leased"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+
+def copy_stream(source, target, length=None):
+    remaining = length
+    while remaining is None or remaining > 0:
+        chunk = source.read(COPY_CHUNK if remaining is None else min(COPY_CHUNK, remaining))
+        if not chunk:
+            break
+        target.write(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+    return remaining in (None, 0)
+
+
+class Coordinator:
+    def __init__(self, input_files, output_files, settings, host="127.0.0.1", port=8765, token=None, segments=False,
+                 ffmpegcmd="ffmpeg", ffprobecmd="ffprobe", retry_failed=False, log=None, lease_timeout=LEASE_TIMEOUT):
+        self.input_files = input_files
+        self.output_files = output_files
+        self.settings = settings
+        self.host = host
+        self.port = port
+        self.token = token
+        self.segments = segments
+        self.ffmpegcmd = ffmpegcmd
+        self.ffprobecmd = ffprobecmd
+        self.retry_failed = retry_failed
+        self.log = log or (lambda message: None)
+        self.lease_timeout = lease_timeout
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.files = {}
+        self.workers = {}
+        self.next_id = 1
+        self.prepared = False
+        self.finished = False
+
+    # Queue, called with the lock held
+
+    def add_task(self, idx, source, segment=None):
+        task_id = self.next_id
+        self.next_id += 1
+        self.tasks[task_id] = {
+            "id": task_id, "idx": idx, "source": source, "segment": segment,
+            "state": PENDING, "worker": None, "deadline": 0.0, "attempts": 0, "progress": None,
+        }
+        self.files[idx]["tasks"].append(task_id)
+
+    def describe(self, task):
+        name = os.path.basename(self.files[task["idx"]]["input"])
+        if task["segment"] is None:
+            return name
+        return f"{name} segment {task['segment'] + 1}/{len(self.files[task['idx']]['tasks'])}"
+
+    def retry_or_fail(self, task, error):
+        task["attempts"] += 1
+        task["worker"] = None
+        if task["attempts"] < MAX_ATTEMPTS:
+            task["state"] = PENDING
+            self.log(f"Requeued {self.describe(task)}: {error}")
+            return
+        task["state"] = TASK_FAILED
+        self.fail_file(task["idx"], f"{self.describe(task)} failed {MAX_ATTEMPTS} times, last error: {error}")
+
+    def fail_file(self, idx, error):
+        entry = self.files[idx]
+        if entry["state"] in (DONE, FAILED):
+            return
+        entry["state"] = FAILED
+        for task_id in entry["tasks"]:
+            if self.tasks[task_id]["state"] in (PENDING, LEASED):
+                self.tasks[task_id]["state"] = TASK_FAILED
+        self.log(f"Error: Compression failed for {entry['input']}: {error}")
+        self.queue.finish(idx, False, error)
+        self.cleanup(entry)
+
+    def finish_file(self, idx, action="", reason=""):
+        entry = self.files[idx]
+        entry["state"] = DONE
+        self.queue.finish(idx, True)
+        self.cleanup(entry)
+        suffix = f" ({action}: {reason})" if action else ""
+        self.log(f"Finished {entry['input']} -> {entry['output']}{suffix}")
+
+    def cleanup(self, entry):
+        if entry["work_dir"]:
+            shutil.rmtree(entry["work_dir"], ignore_errors=True)
+            entry["work_dir"] = None
+
+    def lease(self, worker_id):
+        now = time.monotonic()
+        self.workers[worker_id]["seen"] = now
+        for task in self.tasks.values():
+            if task["state"] == PENDING:
+                task.update(state=LEASED, worker=worker_id, deadline=now + self.lease_timeout, progress=None)
+                self.log(f"Assigned {self.describe(task)} to {self.workers[worker_id]['name']}")
+                return task
+        return None
+
+    def owned_task(self, task_id, worker_id):
+        task = self.tasks.get(task_id)
+        if task and task["state"] == LEASED and task["worker"] == worker_id:
+            return task
+        return None
+
+    def touch(self, task):
+        # Any request about a task shows its worker is alive, same as a heartbeat
+        now = time.monotonic()
+        task["deadline"] = now + self.lease_timeout
+        if task["worker"] in self.workers:
+            self.workers[task["worker"]]["seen"] = now
+
+    def reap(self):
+        now = time.monotonic()
+        for task in self.tasks.values():
+            if task["state"] == LEASED and task["deadline"] < now:
+                worker = self.workers.get(task["worker"], {}).get("name", task["worker"])
+                self.retry_or_fail(task, f"no heartbeat from {worker} for {self.lease_timeout}s")
+        for worker_id, worker in list(self.workers.items()):
+            if now - worker["seen"] > self.lease_timeout:
+                self.log(f"Worker {worker['name']} is gone.")
+                del self.workers[worker_id]
+
+    def all_done(self):
+        return self.prepared and all(entry["state"] in (DONE, FAILED) for entry in self.files.values())
+
+    # Preparation and joining, on the event loop
+
+    async def prepare(self, idx):
+        input_file, output_file = self.input_files[idx], self.output_files[idx]
+        entry = {"input": input_file, "output": output_file, "tasks": [], "state": "preparing", "work_dir": None, "encoder": None}
+        with self.lock:
+            self.files[idx] = entry
+            self.queue.start(idx)
+        try:
+            sources = await self.split(entry) if self.segments else None
+        except Exception as e:
+            with self.lock:
+                self.fail_file(idx, str(e))
+            return
+        with self.lock:
+            if sources:
+                for segment, source in enumerate(sources):
+                    self.add_task(idx, source, segment)
+            else:
+                self.add_task(idx, input_file)
+            entry["state"] = "encoding"
+
+    async def split(self, entry):
+        info = await probe_video(entry["input"], self.ffprobecmd, log=self.log)
+        segments = int(info["duration"] // SEGMENT_SECONDS)
+        if segments < 2:
+            return None
+        encoder = ChunkedEncoder(
+            entry["input"], temp_output_path(entry["output"]), info, self.settings["crf"], self.settings["preset"],
+            self.ffmpegcmd, self.ffprobecmd, log=self.log
+        )
+        boundaries = await encoder.split_points(segments)
+        if not boundaries:
+            return None
+        entry["work_dir"] = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(os.path.abspath(entry["output"])))
+        entry["encoder"] = encoder
+        self.log(f"Splitting {entry['input']} into {len(boundaries) + 1} segments")
+        names = await encoder.split(entry["work_dir"], boundaries)
+        if names is None:
+            # Falls back to handing out the whole file
+            self.cleanup(entry)
+            entry["encoder"] = None
+            return None
+        return [os.path.join(entry["work_dir"], name) for name in names]
+
+    async def join_ready(self):
+        with self.lock:
+            ready = [
+                (idx, entry) for idx, entry in self.files.items()
+                if entry["state"] == "encoding" and entry["encoder"]
+                and all(self.tasks[task_id]["state"] == TASK_DONE for task_id in entry["tasks"])
+            ]
+            for _, entry in ready:
+                entry["state"] = "joining"
+        for idx, entry in ready:
+            temp_file = temp_output_path(entry["output"])
+            ok = await entry["encoder"].join(entry["work_dir"], len(entry["tasks"]))
+            with self.lock:
+                if ok:
+                    commit_output(temp_file, entry["output"])
+                    self.finish_file(idx)
+                else:
+                    discard(temp_file)
+                    entry["state"] = "encoding"
+                    self.fail_file(idx, "joining the segments failed")
+
+    async def run(self):
+        # Bound before the queue is touched, a busy address leaves nothing behind
+        try:
+            server = ThreadingHTTPServer((self.host, self.port), self.handler())
+        except OSError as e:
+            raise OSError(e.errno, f"can't listen on {self.host}:{self.port}: {e.strerror or e}") from e
+        self.queue = JobQueue(self.input_files, self.output_files, self.settings, self.retry_failed)
+        if self.queue.resumed:
+            self.log(f"Resuming batch: {self.queue.count(DONE)} done, {self.queue.count(FAILED)} failed, {len(self.queue.pending())} left")
+
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.log(f"Coordinator listening on http://{self.host}:{server.server_address[1]}")
+
+        async def prepare_all():
+            # Files are split one after another while workers already encode the first ones
+            for idx in self.queue.pending():
+                await self.prepare(idx)
+            self.prepared = True
+
+        preparing = asyncio.create_task(prepare_all())
+        try:
+            while not self.all_done():
+                await asyncio.sleep(0.5)
+                with self.lock:
+                    self.reap()
+                await self.join_ready()
+            await preparing
+            self.finished = True
+            # Give the workers a poll or two to hear that the batch is over
+            await asyncio.sleep(POLL_SECONDS * 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+            with self.lock:
+                for entry in self.files.values():
+                    self.cleanup(entry)
+
+        self.queue.close()
+        failed = self.queue.count(FAILED)
+        if failed:
+            self.log(f"{failed} file(s) failed.")
+        return failed == 0
+
+    def start(self):
+        return asyncio.run(self.run())
+
+    # HTTP
+
+    def handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status, data=None):
+                body = json.dumps(data or {}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def authorized(self):
+                if coordinator.token and not hmac.compare_digest(self.headers.get("X-Token", ""), coordinator.token):
+                    self.reply(403, {"error": "bad token"})
+                    return False
+                return True
+
+            def read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    return json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return {}
+
+            def route(self):
+                parts = self.path.strip("/").split("/")
+                if len(parts) == 3 and parts[0] == "tasks" and parts[1].isdigit():
+                    return parts[2], int(parts[1])
+                return parts[0], None
+
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                action, task_id = self.route()
+                if action != "input" or task_id is None:
+                    self.reply(404)
+                    return
+                with coordinator.lock:
+                    task = coordinator.owned_task(task_id, self.headers.get("X-Worker-Id"))
+                    if task:
+                        coordinator.touch(task)
+                if not task:
+                    self.reply(409, {"error": "task is not leased to this worker"})
+                    return
+                size = os.path.getsize(task["source"])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                with open(task["source"], "rb") as f:
+                    copy_stream(f, self.wfile)
+
+            def do_PUT(self):
+                if not self.authorized():
+                    return
+                action, task_id = self.route()
+                worker_id = self.headers.get("X-Worker-Id")
+                if action != "result" or task_id is None:
+                    self.reply(404)
+                    return
+                with coordinator.lock:
+                    task = coordinator.owned_task(task_id, worker_id)
+                    entry = coordinator.files[task["idx"]] if task else None
+                    if task:
+                        coordinator.touch(task)
+                if not task:
+                    self.reply(409, {"error": "task is not leased to this worker"})
+                    return
+
+                if task["segment"] is None:
+                    target = temp_output_path(entry["output"])
+                else:
+                    target = os.path.join(entry["work_dir"], encoded_name(task["segment"]))
+                upload = target + ".upload"
+                length = int(self.headers.get("Content-Length") or 0)
+                with open(upload, "wb") as f:
+                    complete = copy_stream(self.rfile, f, length)
+                if not complete:
+                    discard(upload)
+                    self.reply(400, {"error": "incomplete upload"})
+                    return
+
+                with coordinator.lock:
+                    # The lease may have timed out while the upload was running
+                    if not coordinator.owned_task(task_id, worker_id):
+                        discard(upload)
+                        self.reply(409, {"error": "task is not leased to this worker"})
+                        return
+                    os.replace(upload, target)
+                    task["state"] = TASK_DONE
+                    if task["segment"] is None:
+                        commit_output(target, entry["output"])
+                        coordinator.finish_file(task["idx"], self.headers.get("X-Action", ""), self.headers.get("X-Reason", ""))
+                self.reply(200)
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                action, task_id = self.route()
+                data = self.read_json()
+                worker_id = self.headers.get("X-Worker-Id") or data.get("worker_id")
+                with coordinator.lock:
+                    if action == "register":
+                        worker_id = f"w{len(coordinator.workers) + 1}-{os.urandom(3).hex()}"
+                        coordinator.workers[worker_id] = {"name": data.get("name") or worker_id, "seen": time.monotonic()}
+                        coordinator.log(f"Worker {coordinator.workers[worker_id]['name']} joined.")
+                        self.reply(200, {"worker_id": worker_id, "heartbeat": HEARTBEAT_SECONDS})
+                        return
+                    if worker_id not in coordinator.workers:
+                        self.reply(401, {"error": "unknown worker, register again"})
+                        return
+                    coordinator.workers[worker_id]["seen"] = time.monotonic()
+
+                    if action == "lease":
+                        if coordinator.finished:
+                            self.reply(200, {"finished": True})
+                            return
+                        task = coordinator.lease(worker_id)
+                        if not task:
+                            self.reply(200, {})
+                            return
+                        self.reply(200, {
+                            "task_id": task["id"],
+                            "kind": "file" if task["segment"] is None else "segment",
+                            "name": coordinator.describe(task),
+                            "ext": os.path.splitext(task["source"])[1],
+                            "settings": coordinator.settings,
+                        })
+                        return
+
+                    task = coordinator.owned_task(task_id, worker_id) if task_id is not None else None
+                    if not task:
+                        self.reply(409, {"error": "task is not leased to this worker"})
+                        return
+                    if action == "heartbeat":
+                        coordinator.touch(task)
+                        if data.get("progress") and data["progress"] != task["progress"]:
+                            task["progress"] = data["progress"]
+                            coordinator.log(f"{coordinator.describe(task)}: {data['progress']}")
+                        self.reply(200)
+                    elif action == "skipped":
+                        task["state"] = TASK_DONE
+                        coordinator.finish_file(task["idx"], SKIP, data.get("reason", ""))
+                        self.reply(200)
+                    elif action == "fail":
+                        coordinator.retry_or_fail(task, data.get("error") or "worker reported a failure")
+                        self.reply(200)
+                    else:
+                        self.reply(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Unauthorized(Exception):
+    pass
+
+
+class Worker:
+    def __init__(self, url, name=None, token=None, ffmpegcmd="ffmpeg", ffprobecmd="ffprobe", log=None):
+        self.url = url.rstrip("/")
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.token = token
+        self.ffmpegcmd = ffmpegcmd
+        self.ffprobecmd = ffprobecmd
+        self.log = log or (lambda message: None)
+        self.worker_id = None
+        self.heartbeat = HEARTBEAT_SECONDS
+        self.progress = None
+        self.lost = False
+
+    def request(self, method, path, data=None, upload=None, download=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["X-Token"] = self.token
+        if self.worker_id:
+            headers["X-Worker-Id"] = self.worker_id
+        body = None
+        if upload:
+            body = open(upload, "rb")
+            headers["Content-Length"] = str(os.path.getsize(upload))
+            headers["Content-Type"] = "application/octet-stream"
+        elif data is not None:
+            body = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.url + path, data=body, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=max(LEASE_TIMEOUT, 60)) as response:
+                if download:
+                    with open(download, "wb") as f:
+                        copy_stream(response, f)
+                    return response.status, {}
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+        finally:
+            if upload:
+                body.close()
+
+    async def call(self, method, path, data=None, **kwargs):
+        return await asyncio.to_thread(self.request, method, path, data, **kwargs)
+
+    async def register(self):
+        status, reply = await self.call("POST", "/register", {"name": self.name})
+        if status == 403:
+            raise Unauthorized()
+        if status != 200:
+            raise OSError(f"coordinator refused to register this worker (HTTP {status})")
+        self.worker_id = reply["worker_id"]
+        self.heartbeat = reply.get("heartbeat", HEARTBEAT_SECONDS)
+        self.log(f"Registered with {self.url} as {self.worker_id}")
+
+    async def run(self):
+        offline = False
+        while True:
+            try:
+                if not self.worker_id:
+                    await self.register()
+                status, task = await self.call("POST", "/lease", {})
+                offline = False
+                if status == 403:
+                    raise Unauthorized()
+            except Unauthorized:
+                self.log(f"Error: the coordinator at {self.url} rejected the token, check --token.")
+                return False
+            except OSError as e:
+                if not offline:
+                    self.log(f"Coordinator at {self.url} is not reachable ({e}), retrying...")
+                    offline = True
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            if status == 401:
+                self.worker_id = None
+                continue
+            if task.get("finished"):
+                self.log("The coordinator has no more work, exiting.")
+                return True
+            if not task.get("task_id"):
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            await self.process(task)
+
+    async def process(self, task):
+        task_id = task["task_id"]
+        self.log(f"Working on {task['name']}")
+        work_dir = tempfile.mkdtemp(prefix="krrsnk-worker-")
+        self.progress = None
+        self.lost = False
+        # The heartbeat covers the transfers too, a big file can take longer than the lease to download or upload
+        working = asyncio.create_task(self.work(task, work_dir))
+        beating = asyncio.create_task(self.keep_lease(task_id, working))
+        try:
+            await working
+        except asyncio.CancelledError:
+            if not self.lost:
+                raise
+            self.log(f"Lost the lease on {task['name']}, dropping it.")
+        except LeaseLost:
+            self.log(f"Lost the lease on {task['name']}, dropping it.")
+        except OSError as e:
+            self.log(f"Error: {task['name']}: {e}")
+        finally:
+            beating.cancel()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def work(self, task, work_dir):
+        task_id = task["task_id"]
+        input_file = os.path.join(work_dir, "input" + task["ext"])
+        output_file = os.path.join(work_dir, "output.mp4")
+        status, _ = await self.call("GET", f"/tasks/{task_id}/input", download=input_file)
+        if status != 200:
+            raise LeaseLost()
+
+        action, reason, error = await self.encode(task, input_file, output_file)
+        if error:
+            self.log(f"Error: {task['name']} failed: {error}")
+            await self.call("POST", f"/tasks/{task_id}/fail", {"error": error})
+        elif action == SKIP:
+            await self.call("POST", f"/tasks/{task_id}/skipped", {"reason": reason})
+        else:
+            headers = {"X-Action": action or "", "X-Reason": reason or ""}
+            status, _ = await self.call("PUT", f"/tasks/{task_id}/result", upload=output_file, headers=headers)
+            if status != 200:
+                raise LeaseLost()
+            self.log(f"Sent the result for {task['name']}")
+
+    async def keep_lease(self, task_id, working):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                status, _ = await self.call("POST", f"/tasks/{task_id}/heartbeat", {"progress": self.progress})
+            except OSError:
+                # The coordinator may just be busy, it will reassign the task if it really is gone
+                continue
+            if status != 200:
+                # Reassigned to someone else, stop wasting CPU on it
+                self.lost = True
+                working.cancel()
+                return
+
+    async def encode(self, task, input_file, output_file):
+        settings = task["settings"]
+        if task["kind"] == "segment":
+            def on_progress(event):
+                self.progress = f"frame {event.frame}"
+
+            process = FFmpegProcess(
+                segment_command(self.ffmpegcmd, input_file, output_file, settings["crf"], settings["preset"]), on_progress
+            )
+            if await process.run() != 0:
+                return None, None, "\n".join(process.tail()[-5:]) or f"ffmpeg exited with code {process.returncode}"
+            return None, None, None
+
+        engine = CompressionEngine(
+            settings["crf"], settings["preset"], self.ffmpegcmd, self.ffprobecmd, jobs=1,
+            auto_target=settings["auto_target"], target_size=settings["target_size"],
+            always_encode=settings["always_encode"], skip_efficient=settings["skip_efficient"]
+        )
+
+        def on_progress(current, total, idx):
+            self.progress = f"{current * 100 // total}%" if total else None
+
+        forwarding = asyncio.create_task(forward_events(engine.subscribe(), on_progress, self.log))
+        try:
+            result = await engine.submit(input_file, output_file)
+        finally:
+            engine.close()
+            await forwarding
+        if not result.ok:
+            return result.action, result.reason, f"{result.action or 'compression'} failed on {self.name}, see its log"
+        return result.action, result.reason, None
+
+    def start(self):
+        return asyncio.run(self.run())
@@ -0,0 +1,618 @@
+import os
+import stat
+import time
+import asyncio
+import contextlib
+from dataclasses import dataclass
+from probe import probe_video, preread
+from progress import FFmpegProcess, progress_position, describe_progress
+from scheduler import plan_jobs, thread_args, cpu_count, gather_limited, helper_priority, active_governor
+from chunked import ChunkedEncoder
+from twopass import TwoPassEncoder
+from decision import decide, ENCODE, REMUX, SKIP
+from autocrf import CrfSearch, DEFAULT_TARGET, estimate_size
+from jobqueue import JobQueue, DONE, FAILED, temp_output_path, commit_output, discard
+from metrics import JobMetrics
+from presets import pick_preset
+from ladder import ladder_spec, ladder_command, rendition_path, renditions_for
+
+LOG = "log"
+PROGRESS = "progress"
+COMPLETE = "complete"
+FAILURE = "failed"
+SKIPPED = "skipped"
+
+LOOKAHEAD = 2
+PROBE_JOBS = 2
+PROBE_NICE = 10
+PROBE_IO = "low"
+
+
+@dataclass
+class EngineEvent:
+    kind: str
+    idx: int = -1
+    message: str = ""
+    current: int = 0
+    total: int = 0
+    output_file: str = ""
+    compressed_size: int = 0
+    compression_pct: float = 0.0
+    action: str = ""
+    reason: str = ""
+
+
+@dataclass
+class JobResult:
+    idx: int
+    input_file: str
+    output_file: str
+    ok: bool
+    action: str = ENCODE
+    reason: str = ""
+    compressed_size: int = 0
+    compression_pct: float = 0.0
+
+
+class Job:
+    def __init__(self, idx, input_file, output_file, task):
+        self.idx = idx
+        self.input_file = input_file
+        self.output_file = output_file
+        self.task = task
+
+    def __await__(self):
+        return self.task.__await__()
+
+
+class CompressionEngine:
+    def __init__(self, crf_value=20, preset="slow", ffmpegcmd="ffmpeg", ffprobecmd="ffprobe", jobs=None,
+                 chunked=False, split_mode="keyframe", auto_target=DEFAULT_TARGET, target_size=None,
+                 always_encode=False, skip_efficient=False, manifest=None, metrics=None,
+                 lookahead=LOOKAHEAD, probe_jobs=PROBE_JOBS, probe_nice=PROBE_NICE, probe_io=PROBE_IO,
+                 preread=False, decide_ahead=False, speed=None, deadline=None, profile=None, ladder=None, governor=None):
+        if crf_value not in (None, "auto"):
+            crf_value = max(0, min(51, int(crf_value)))
+        self.crf_value = crf_value
+        self.preset = preset
+        self.ffmpegcmd = ffmpegcmd
+        self.ffprobecmd = ffprobecmd
+        self.jobs = jobs
+        self.chunked = chunked
+        self.split_mode = split_mode
+        self.auto_target = auto_target
+        self.target_size = target_size
+        self.always_encode = always_encode
+        self.skip_efficient = skip_efficient
+        self.manifest = manifest
+        self.metrics = metrics
+        self.lookahead = max(0, lookahead)
+        self.probe_jobs = max(1, probe_jobs)
+        self.probe_nice = probe_nice
+        self.probe_io = probe_io
+        self.preread = preread
+        self.decide_ahead = decide_ahead
+        # Preset picked per batch from the calibration profile, for a speed or a deadline
+        self.speed = speed
+        self.deadline = deadline
+        self.profile = profile
+        # Renditions made from one decode of each input instead of a single output
+        self.ladder = ladder
+        self.governor = governor
+        self.window = None
+        self.probe_slots = None
+        self.probe_times = {}
+        self.job_metrics = {}
+        self.queue = None
+        self.subscribers = []
+        self.total_files = 0
+        self.failed = 0
+        self.slots = None
+        self.configure(*plan_jobs([], jobs))
+
+    # Events
+
+    def subscribe(self):
+        # Registers right away, so nothing emitted after this call is missed
+        queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return self.iterate_events(queue)
+
+    async def iterate_events(self, queue):
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            if queue in self.subscribers:
+                self.subscribers.remove(queue)
+
+    def emit(self, event):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def log(self, message):
+        self.emit(EngineEvent(LOG, message=message))
+
+    def progress(self, idx, current, total):
+        self.emit(EngineEvent(PROGRESS, idx=idx, current=current, total=total))
+
+    def close(self):
+        for queue in list(self.subscribers):
+            queue.put_nowait(None)
+
+    # Jobs
+
+    def configure(self, job_count, job_threads):
+        self.job_count = job_count
+        self.job_threads = job_threads
+        self.slots = asyncio.Semaphore(job_count)
+
+    def submit(self, input_file, output_file, info=None, idx=None, analysis=None):
+        if idx is None:
+            idx = self.total_files
+            self.total_files += 1
+        task = asyncio.ensure_future(self.run_job(idx, input_file, output_file, info, analysis))
+        return Job(idx, input_file, output_file, task)
+
+    async def run_job(self, idx, input_file, output_file, info=None, analysis=None):
+        job = self.job_metrics[idx] = JobMetrics(idx, input_file, output_file)
+        queued = time.monotonic()
+        # Every ffmpeg this job starts runs under the governor's limits
+        active_governor.set(self.governor)
+        async with self.slots, self.turn():
+            job.queue_wait = time.monotonic() - queued
+            try:
+                decision = None
+                if analysis is not None:
+                    try:
+                        info, decision = await analysis
+                    finally:
+                        # This file is no longer ahead of the encodes, the next one may be analyzed
+                        self.window.release()
+                if info is None:
+                    info = await self.probe(input_file)
+                job.probe_time = self.probe_times.get(input_file, 0.0)
+                job.frames, job.duration = info["frames"], info["duration"]
+                result = await self.compress_file(idx, input_file, output_file, info, decision)
+            except Exception as e:
+                self.log(f"Error: Compression failed for {input_file}: {e}")
+                if self.queue:
+                    self.queue.finish(idx, False, str(e))
+                self.emit(EngineEvent(FAILURE, idx=idx, output_file=output_file, reason=str(e)))
+                result = JobResult(idx, input_file, output_file, False, reason=str(e))
+            job.finish(result)
+            if self.metrics:
+                self.metrics.record(job)
+            del self.job_metrics[idx]
+            return result
+
+    @contextlib.asynccontextmanager
+    async def turn(self):
+        # The governor may run fewer jobs than there are slots while the system is loaded
+        if self.governor is None:
+            yield
+            return
+        async with self.governor.turn(self.job_count):
+            yield
+
+    async def run_batch(self, input_files, output_files, retry_failed=False):
+        self.total_files = len(input_files)
+        self.queue = JobQueue(input_files, output_files, self.encode_params(), retry_failed)
+        if self.queue.resumed:
+            self.log(f"Resuming batch: {self.queue.count(DONE)} done, {self.queue.count(FAILED)} failed, {len(self.queue.pending())} left")
+
+        pending = []
+        for idx in self.queue.pending():
+            input_file, output_file = input_files[idx], output_files[idx]
+            if self.is_unchanged(input_file, output_file):
+                self.queue.finish(idx, True)
+            else:
+                pending.append((idx, input_file, output_file))
+
+        # Started before planning, so the job count sees the CPUs the governor pins us to
+        if self.governor and pending:
+            self.governor.start(self, os.path.dirname(os.path.abspath(pending[0][2])))
+        try:
+            results = await self.run_pending(pending)
+        finally:
+            if self.governor:
+                await self.governor.stop()
+
+        self.queue.close()
+        self.failed = self.queue.count(FAILED)
+        if self.failed:
+            self.log(f"{self.failed} file(s) failed.")
+        if self.manifest:
+            for output_file in self.manifest.orphans():
+                self.log(f"Orphaned output (its input no longer exists): {output_file}")
+        return results
+
+    async def run_pending(self, pending):
+        infos, analyses = [None] * len(pending), [None] * len(pending)
+        if self.lookahead and pending:
+            # Probing runs ahead of the encodes, so the next file is ready when a slot frees up.
+            # The job count is planned from the first files only.
+            self.window = asyncio.Semaphore(self.lookahead)
+            self.probe_slots = asyncio.Semaphore(self.probe_jobs)
+            analyses = [asyncio.ensure_future(self.analyze(input_file)) for _, input_file, _ in pending]
+            await asyncio.wait(analyses[:self.lookahead])
+            heights = [task.result()[0]["height"] for task in analyses[:self.lookahead] if not task.exception()]
+        else:
+            infos = await gather_limited(
+                [self.probe(input_file) for _, input_file, _ in pending], cpu_count(), return_exceptions=True
+            )
+            # A file that can't be probed fails in its own job, which probes it again
+            infos = [None if isinstance(info, Exception) else info for info in infos]
+            heights = [info["height"] for info in infos if info]
+        if self.chunked:
+            # Chunked mode already spreads one file over all cores, so files go one by one
+            self.configure(1, cpu_count())
+        else:
+            self.configure(*plan_jobs(heights, self.jobs, count=len(pending)))
+        if self.profile and (self.speed or self.deadline) and pending:
+            await self.choose_preset(pending, heights)
+        if self.job_count > 1:
+            self.log(f"Running {self.job_count} compressions at once, {self.job_threads} threads each")
+
+        jobs = [
+            self.submit(input_file, output_file, info, idx, analysis)
+            for (idx, input_file, output_file), info, analysis in zip(pending, infos, analyses)
+        ]
+        return await asyncio.gather(*(job.task for job in jobs))
+
+    # Stages
+
+    async def analyze(self, input_file):
+        # Waits until it is one of the next `lookahead` files, released by run_job once its encode starts
+        await self.window.acquire()
+        # Only this task's context, the encodes keep their normal priority
+        helper_priority.set((self.probe_nice, self.probe_io))
+        active_governor.set(self.governor)
+        async with self.probe_slots:
+            info = await self.probe(input_file)
+            if self.preread:
+                await preread(input_file)
+            decision = await self.decide(input_file, info) if self.decide_ahead else None
+        return info, decision
+
+    async def probe(self, input_file):
+        started = time.monotonic()
+        info = await probe_video(input_file, self.ffprobecmd, log=self.log)
+        self.probe_times[input_file] = time.monotonic() - started
+        return info
+
+    async def choose_preset(self, pending, heights):
+        speed = self.speed
+        if self.deadline:
+            # A deadline needs the length of the whole batch, the look-ahead gets these probes from the cache
+            infos = await gather_limited(
+                [self.probe(input_file) for _, input_file, _ in pending], cpu_count(), return_exceptions=True
+            )
+            speed = sum(info["duration"] for info in infos if not isinstance(info, Exception)) / self.deadline
+        jobs = 1 if self.chunked else self.jobs
+        entry, estimated, met = pick_preset(self.profile, speed, max(heights, default=0), len(pending), jobs)
+        if entry is None:
+            return
+        self.preset = entry["preset"]
+        if not jobs:
+            self.configure(entry["jobs"], max(1, cpu_count() // entry["jobs"]))
+        if met:
+            self.log(f"Preset {self.preset}: about {estimated:.2f}x real time with {self.job_count} job(s), target {speed:.2f}x")
+        else:
+            self.log(f"Warning: no calibrated preset reaches {speed:.2f}x real time, using {self.preset} (about {estimated:.2f}x)")
+
+    def preset_rule(self):
+        # Resumed batches and the manifest compare this, not the preset the rule picked
+        if self.profile and self.deadline:
+            return f"deadline:{self.deadline:g}s"
+        if self.profile and self.speed:
+            return f"speed:{self.speed:g}x"
+        return self.preset
+
+    def encode_params(self):
+        if self.target_size:
+            return {"codec": "libx265", "target_size": self.target_size, "preset": self.preset_rule()}
+        params = {"codec": "libx265", "crf": self.crf_value, "preset": self.preset_rule()}
+        if self.crf_value == "auto":
+            params["target"] = self.auto_target
+        if self.ladder:
+            params["ladder"] = ladder_spec(self.ladder)
+        return params
+
+    def is_unchanged(self, input_file, output_file):
+        if self.manifest and self.ladder:
+            # Renditions taller than the input were never made, the manifest only knows the others
+            outputs = [rendition_path(output_file, rendition) for rendition in self.ladder]
+            known = [path for path in outputs if os.path.basename(path) in self.manifest.entries]
+            if known and all(self.manifest.is_unchanged(input_file, path, self.encode_params()) for path in known):
+                self.log(f"Skipping {input_file}: unchanged since the last run.")
+                return True
+            return False
+        if self.manifest and self.manifest.is_unchanged(input_file, output_file, self.encode_params()):
+            self.log(f"Skipping {input_file}: unchanged since the last run.")
+            return True
+        return False
+
+    async def decide(self, input_file, info):
+        if self.always_encode:
+            return ENCODE, "decision stage disabled"
+        crf_value = self.crf_value if self.crf_value != "auto" else None
+        return await decide(
+            info, crf_value, self.target_size, skip_efficient=self.skip_efficient,
+            estimate=lambda: estimate_size(input_file, info, crf_value, self.preset, self.ffmpegcmd)
+        )
+
+    async def pick_crf(self, input_file, info):
+        if self.crf_value != "auto":
+            return self.crf_value
+        crf_value = await CrfSearch(input_file, info, self.auto_target, self.preset, self.ffmpegcmd, log=self.log).run()
+        if crf_value is not None:
+            self.log(f"Auto CRF picked {crf_value} for {input_file} ({self.auto_target})")
+        return crf_value
+
+    async def compress_file(self, idx, input_file, output_file, info, decision=None):
+        if self.ladder:
+            return await self.compress_ladder(idx, input_file, output_file, info)
+        action, reason = decision or await self.decide(input_file, info)
+        if action == SKIP:
+            self.log(f"Skipping {input_file}: {reason}")
+            if self.queue:
+                self.queue.finish(idx, True)
+            self.emit(EngineEvent(SKIPPED, idx=idx, output_file=output_file, action=action, reason=reason))
+            return JobResult(idx, input_file, output_file, True, action, reason)
+
+        # Encode next to the output and rename when done, so a crash never leaves a truncated output
+        if self.queue:
+            self.queue.start(idx)
+        temp_file = temp_output_path(output_file)
+        ok = False
+        started = time.monotonic()
+        try:
+            if action == REMUX:
+                ok = await self.remux_file(idx, input_file, temp_file)
+                if not ok:
+                    self.log(f"Encoding {input_file} instead.")
+                    discard(temp_file)
+                    action, reason = ENCODE, f"remux failed, {reason}"
+                    started = time.monotonic()
+            if action == ENCODE:
+                ok = await self.encode_file(idx, input_file, temp_file, info)
+            if ok:
+                commit_output(temp_file, output_file)
+        finally:
+            job = self.job_metrics[idx]
+            job.encode_wall = time.monotonic() - started - job.crf_search
+            if not ok:
+                discard(temp_file)
+            if self.queue:
+                self.queue.finish(idx, ok)
+
+        if not ok:
+            self.emit(EngineEvent(FAILURE, idx=idx, output_file=output_file, action=action, reason=reason))
+            return JobResult(idx, input_file, output_file, False, action, reason)
+        return await self.report_complete(idx, input_file, output_file, action, reason)
+
+    async def remux_file(self, idx, input_file, output_file):
+        self.log(f"Remuxing {input_file} without re-encoding")
+        # Subtitles and data streams often can't be copied into MP4, keep the video and audio only
+        process = FFmpegProcess(
+            [self.ffmpegcmd, "-i", input_file, "-map", "0:v:0", "-map", "0:a?", "-c", "copy", "-y", output_file]
+        )
+        if await process.run() != 0:
+            self.log(f"Error: Remux failed for {input_file}.")
+            for line in process.tail():
+                self.log(f"  {line}")
+            return False
+        # Only counted when it worked, a failed remux is followed by an encode with its own numbers
+        self.job_metrics[idx].add_process(process)
+        return True
+
+    async def encode_file(self, idx, input_file, output_file, info):
+        if self.target_size:
+            return await self.encode_two_pass(idx, input_file, output_file, info)
+
+        searched = time.monotonic()
+        crf_value = await self.pick_crf(input_file, info)
+        if self.crf_value == "auto":
+            self.job_metrics[idx].crf_search = time.monotonic() - searched
+        if crf_value is None:
+            self.log(f"Error: Compression failed for {input_file}: could not pick a CRF value.")
+            return False
+
+        if self.chunked:
+            encoder = ChunkedEncoder(
+                input_file, output_file, info, crf_value, self.preset, self.ffmpegcmd, self.ffprobecmd,
+                split_mode=self.split_mode, log=self.log,
+                progress=lambda current, total: self.progress(idx, current, total),
+                on_exit=self.job_metrics[idx].add_process
+            )
+            result = await encoder.run()
+            if result is not None:
+                return result
+            self.log(f"Compressing {input_file} as a whole.")
+
+        total_frames = info["frames"]
+        duration = info["duration"]
+        if total_frames == 0:
+            if duration:
+                self.log(f"Frame count unavailable for {input_file}, progress will be based on duration.")
+            else:
+                self.log(f"Frame count and duration unavailable for {input_file}, progress will not be shown.")
+
+        decode_args, encode_args = thread_args(self.job_threads, self.job_count)
+        command = [
+            self.ffmpegcmd, *decode_args, "-i", input_file,
+            "-vcodec", "libx265", "-crf", str(crf_value), "-preset", self.preset, *encode_args,
+            "-acodec", "copy", "-y", output_file
+        ]
+
+        self.log(f"Starting compression for {input_file} with CRF value: {crf_value}")
+        return await self.run_encode(idx, input_file, command, info)
+
+    async def run_encode(self, idx, input_file, command, info):
+        total_frames = info["frames"]
+        duration = info["duration"]
+
+        def on_progress(event):
+            position = progress_position(event, total_frames, duration)
+            if position:
+                self.progress(idx, *position)
+            self.log(f"File {idx+1}/{self.total_files} - {describe_progress(event, total_frames, duration)}")
+
+        process = FFmpegProcess(command, on_progress, on_exit=self.job_metrics[idx].add_process)
+        if await process.run() != 0:
+            self.log(f"Error: Compression failed for {input_file}.")
+            for line in process.tail():
+                self.log(f"  {line}")
+            return False
+        return True
+
+    async def compress_ladder(self, idx, input_file, output_file, info):
+        renditions = renditions_for(self.ladder, info["height"])
+        outputs = [(rendition, rendition_path(output_file, rendition)) for rendition in renditions]
+        temps = [(rendition, temp_output_path(path)) for rendition, path in outputs]
+        skipped = [rendition.suffix for rendition in self.ladder if rendition not in renditions]
+        if skipped:
+            self.log(f"Not upscaling {input_file} ({info['height']}p) to {', '.join(skipped)}")
+
+        if self.queue:
+            self.queue.start(idx)
+        ok = False
+        started = time.monotonic()
+        try:
+            command = ladder_command(self.ffmpegcmd, input_file, temps, self.preset, self.job_threads, self.job_count)
+            self.log(f"Starting compression for {input_file} into {', '.join(r.suffix for r in renditions)}")
+            ok = await self.run_encode(idx, input_file, command, info)
+            if ok:
+                for (_, temp_file), (_, path) in zip(temps, outputs):
+                    commit_output(temp_file, path)
+        finally:
+            self.job_metrics[idx].encode_wall = time.monotonic() - started
+            if not ok:
+                for _, temp_file in temps:
+                    discard(temp_file)
+            if self.queue:
+                self.queue.finish(idx, ok)
+
+        reason = f"{len(renditions)} rendition(s) from one decode"
+        if not ok:
+            self.emit(EngineEvent(FAILURE, idx=idx, output_file=output_file, action=ENCODE, reason=reason))
+            return JobResult(idx, input_file, output_file, False, ENCODE, reason)
+        # One completion per rendition, in the same shape as single outputs
+        results = [
+            await self.report_complete(idx, input_file, path, ENCODE, f"{rendition.suffix} rendition, CRF {rendition.crf}")
+            for rendition, path in outputs
+        ]
+        compressed_size = sum(result.compressed_size for result in results)
+        compression_pct = (1 - compressed_size / os.path.getsize(input_file)) * 100
+        return JobResult(idx, input_file, output_file, True, ENCODE, reason, compressed_size, compression_pct)
+
+    async def encode_two_pass(self, idx, input_file, output_file, info):
+        decode_args, encode_args = thread_args(self.job_threads, self.job_count)
+        encoder = TwoPassEncoder(
+            input_file, output_file, info, self.target_size, self.preset, self.ffmpegcmd,
+            decode_args=decode_args, x265_params=encode_args[1] if encode_args else "", log=self.log,
+            progress=lambda current, total: self.progress(idx, current, total),
+            on_exit=self.job_metrics[idx].add_process
+        )
+        return await encoder.run()
+
+    async def stream_file(self, input_file, output_file):
+        # "-" is stdin/stdout, anything else may be a named pipe. Nothing here can seek, so there is
+        # no probe, decision or temp file, and the MP4 is fragmented so its index never needs rewriting.
+        idx = 0
+        self.total_files = 1
+        job = self.job_metrics[idx] = JobMetrics(idx, input_file, output_file)
+        decode_args, encode_args = thread_args(self.job_threads, self.job_count)
+        command = [
+            self.ffmpegcmd, *decode_args, "-i", "pipe:0" if input_file == "-" else input_file,
+            "-vcodec", "libx265", "-crf", str(self.crf_value), "-preset", self.preset, *encode_args,
+            "-acodec", "copy", "-movflags", "frag_keyframe+empty_moov", "-f", "mp4",
+            "-y", "pipe:1" if output_file == "-" else output_file
+        ]
+        self.log(f"Streaming {'stdin' if input_file == '-' else input_file} with CRF value: {self.crf_value}")
+
+        def on_progress(event):
+            # No frame count or duration up front, only the encoded time is known
+            self.log(f"Streaming - {describe_progress(event, 0, 0)}")
+
+        process = FFmpegProcess(
+            command, on_progress, on_exit=job.add_process,
+            stdin=0 if input_file == "-" else None, stdout=1 if output_file == "-" else None
+        )
+        active_governor.set(self.governor)
+        if self.governor:
+            self.governor.start(self, os.getcwd() if output_file == "-" else os.path.dirname(os.path.abspath(output_file)))
+        started = time.monotonic()
+        try:
+            returncode = await process.run()
+        finally:
+            if self.governor:
+                await self.governor.stop()
+        job.encode_wall = time.monotonic() - started
+        job.frames, job.duration = process.last_event.frame, process.last_event.out_time
+
+        if returncode != 0:
+            self.log(f"Error: Streaming compression failed for {input_file}.")
+            for line in process.tail():
+                self.log(f"  {line}")
+            self.emit(EngineEvent(FAILURE, idx=idx, output_file=output_file))
+            result = JobResult(idx, input_file, output_file, False)
+        else:
+            compressed_size = process.last_event.total_size
+            self.emit(EngineEvent(
+                COMPLETE, idx=idx, output_file=output_file, compressed_size=compressed_size,
+                action=ENCODE, reason="streamed"
+            ))
+            result = JobResult(idx, input_file, output_file, True, ENCODE, "streamed", compressed_size)
+        self.failed = 0 if result.ok else 1
+        job.finish(result)
+        if self.metrics:
+            self.metrics.record(job)
+        del self.job_metrics[idx]
+        return result
+
+    async def report_complete(self, idx, input_file, output_file, action, reason):
+        if self.manifest:
+            # Checksums the whole output, off the loop so the other jobs' ffmpeg pipes keep being read
+            await asyncio.to_thread(self.manifest.record, input_file, output_file, self.encode_params())
+
+        compressed_size = os.path.getsize(output_file)
+        original_size = os.path.getsize(input_file)
+        compression_pct = (1 - compressed_size / original_size) * 100
+        self.emit(EngineEvent(
+            COMPLETE, idx=idx, output_file=output_file, compressed_size=compressed_size,
+            compression_pct=compression_pct, action=action, reason=reason
+        ))
+        return JobResult(idx, input_file, output_file, True, action, reason, compressed_size, compression_pct)
+
+
+def output_path(input_file, output_folder):
+    return os.path.join(output_folder, f"{os.path.splitext(os.path.basename(input_file))[0]}_compressed.mp4")
+
+
+def is_stream(path):
+    # stdin/stdout or a named pipe, only readable or writable once from front to back
+    if path == "-":
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+async def forward_events(events, progress=None, log=None, complete=None):
+    # Adapter for the callback/signal style the GUIs use
+    async for event in events:
+        if event.kind == PROGRESS and progress:
+            progress(event.current, event.total, event.idx)
+        elif event.kind == LOG and log:
+            log(event.message)
+        elif event.kind == COMPLETE:
+            if log:
+                log(f"File {event.idx+1}: {event.action} ({event.reason})")
+            if complete:
+                complete(event.output_file, event.compressed_size, event.compression_pct, event.idx)
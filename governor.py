@@ -0,0 +1,281 @@
+import os
+import re
+import sys
+import signal
+import shutil
+import asyncio
+import contextlib
+from scheduler import low_priority, cpu_count
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CPU_PERIOD = 100000
+CHECK_SECONDS = 5.0
+# Throttling only eases off once the pressure is clearly gone, so it doesn't flap
+RECOVER_RATIO = 0.8
+
+size_pattern = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?$')
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_size(text):
+    # "512M", "4G", "4GiB" or plain bytes
+    match = size_pattern.match(text.strip().lower())
+    if not match:
+        raise ValueError(f"Unknown size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_cpus(text):
+    # "0-3,6" like taskset
+    cpus = set()
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    if not cpus:
+        raise ValueError(f"No CPUs in {text}")
+    if hasattr(os, "sched_getaffinity"):
+        unavailable = cpus - os.sched_getaffinity(0)
+        if unavailable:
+            raise ValueError(f"CPUs not available to this process: {','.join(map(str, sorted(unavailable)))}")
+    return cpus
+
+
+def format_size(size):
+    return f"{size / (1 << 30):.1f} GB"
+
+
+def write_file(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+class Governor:
+    def __init__(self, nice=0, io="normal", cpus=None, cpu_max=None, memory_max=None,
+                 max_load=None, min_free_disk=None, interval=CHECK_SECONDS):
+        self.nice = nice
+        self.io = io
+        self.cpus = cpus
+        self.cpu_max = cpu_max
+        self.memory_max = memory_max
+        self.max_load = max_load
+        self.min_free_disk = min_free_disk
+        self.interval = interval
+        self.log = lambda message: None
+        self.processes = set()
+        self.cgroup = None
+        self.cgroup_dirs = None
+        # Controllers create_cgroup turned on in the parent, the only ones remove_cgroup turns off
+        self.enabled_controllers = []
+        self.rlimit = False
+        self.paused = False
+        # Jobs running and job slots the load has taken away
+        self.running = 0
+        self.reduced = 0
+        self.turns = None
+        self.task = None
+
+    # Launch, called for every ffmpeg/ffprobe through scheduler.start_process
+
+    def prepare(self, command, extra):
+        command, priority = low_priority(command, self.nice, self.io)
+        if "creationflags" in priority:
+            extra = dict(extra, creationflags=priority["creationflags"])
+        return self.confine(command), extra
+
+    def confine(self, command):
+        # A shell applies the limit to itself and execs the command in its place, like nice and ionice do,
+        # so the process never runs a moment without it
+        if self.cgroup:
+            return ["sh", "-c", 'echo $$ > "$0" && exec "$@"', os.path.join(self.cgroup, "cgroup.procs"), *command]
+        if self.rlimit:
+            # Per process and virtual memory (RLIMIT_AS), x265 reserves more than it touches
+            return ["sh", "-c", f'ulimit -v {self.memory_max // 1024} && exec "$@"', "sh", *command]
+        return command
+
+    def attach(self, process):
+        self.processes.add(process)
+        if self.paused:
+            try:
+                os.kill(process.pid, signal.SIGSTOP)
+            except OSError as e:
+                self.log(f"Governor: couldn't pause process {process.pid}: {e}")
+
+    # Setup
+
+    def setup(self):
+        if self.nice or self.io != "normal":
+            self.log(f"Governor: encodes run at nice {self.nice}, I/O priority {self.io}")
+        if self.cpus:
+            if hasattr(os, "sched_setaffinity"):
+                # Set on this process, the encodes inherit it and job planning sees the same cores
+                try:
+                    os.sched_setaffinity(0, self.cpus)
+                    self.log(f"Governor: pinned to CPUs {','.join(map(str, sorted(self.cpus)))}")
+                except OSError as e:
+                    self.log(f"Governor: couldn't pin to CPUs {','.join(map(str, sorted(self.cpus)))}: {e}")
+            else:
+                self.log("Governor: CPU affinity isn't supported on this platform, ignoring --cpus")
+        if self.cpu_max or self.memory_max:
+            self.cgroup, reason = self.create_cgroup()
+            if self.cgroup:
+                limits = []
+                if self.cpu_max:
+                    limits.append(f"cpu.max {self.cpu_max:g} cores")
+                if self.memory_max:
+                    limits.append(f"memory.max {format_size(self.memory_max)}")
+                self.log(f"Governor: cgroup v2 limits for all encodes together: {', '.join(limits)}")
+            else:
+                self.log(f"Governor: cgroup v2 limits unavailable ({reason})")
+                if self.cpu_max:
+                    self.log("Governor: CPU cap needs cgroup v2, only nice and affinity apply")
+                if self.memory_max and os.name == "posix" and shutil.which("sh"):
+                    self.rlimit = True
+                    self.log(f"Governor: capping each ffmpeg at {format_size(self.memory_max)} of address space (RLIMIT_AS)")
+                elif self.memory_max:
+                    self.log("Governor: no way to cap memory on this platform, ignoring --memory-max")
+
+    def create_cgroup(self):
+        if not sys.platform.startswith("linux") or not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+            return None, "not a cgroup v2 system"
+        try:
+            with open("/proc/self/cgroup") as f:
+                own = next(line[3:].strip() for line in f if line.startswith("0::"))
+        except (OSError, StopIteration):
+            return None, "can't find our cgroup"
+        base = CGROUP_ROOT + own.rstrip("/")
+        main = os.path.join(base, f"krrsnk-{os.getpid()}-main")
+        encodes = os.path.join(base, f"krrsnk-{os.getpid()}-encodes")
+        self.cgroup_dirs = (base, main, encodes)
+        try:
+            os.mkdir(main)
+            os.mkdir(encodes)
+            # A cgroup that hands controllers down can't hold processes, so we step into a leaf first
+            write_file(os.path.join(main, "cgroup.procs"), str(os.getpid()))
+            # Controllers that were on before (systemd scope, container root) stay on for our siblings too
+            with open(os.path.join(base, "cgroup.subtree_control")) as f:
+                active = f.read().split()
+            missing = [controller for controller in ("cpu", "memory") if controller not in active]
+            if missing:
+                write_file(os.path.join(base, "cgroup.subtree_control"), " ".join(f"+{c}" for c in missing))
+                self.enabled_controllers = missing
+            if self.cpu_max:
+                write_file(os.path.join(encodes, "cpu.max"), f"{int(self.cpu_max * CPU_PERIOD)} {CPU_PERIOD}")
+            if self.memory_max:
+                write_file(os.path.join(encodes, "memory.max"), str(self.memory_max))
+        except OSError as e:
+            self.remove_cgroup()
+            return None, e.strerror or str(e)
+        return encodes, None
+
+    def remove_cgroup(self):
+        base, main, encodes = self.cgroup_dirs
+        disable = " ".join(f"-{controller}" for controller in self.enabled_controllers)
+        for action in (
+            lambda: os.rmdir(encodes),
+            lambda: disable and write_file(os.path.join(base, "cgroup.subtree_control"), disable),
+            lambda: write_file(os.path.join(base, "cgroup.procs"), str(os.getpid())),
+            lambda: os.rmdir(main),
+        ):
+            try:
+                action()
+            except OSError:
+                pass
+        self.enabled_controllers = []
+
+    # Throttling
+
+    def pause(self, reason):
+        self.paused = True
+        self.log(f"Governor: {reason}, pausing {len(self.processes)} process(es)")
+        self.signal_all(signal.SIGSTOP)
+
+    def resume(self, reason):
+        self.paused = False
+        self.log(f"Governor: {reason}, resuming")
+        self.signal_all(signal.SIGCONT)
+
+    def signal_all(self, signum):
+        for process in list(self.processes):
+            # An exited process's pid may already belong to something else
+            if process.returncode is None:
+                try:
+                    os.kill(process.pid, signum)
+                except OSError:
+                    pass
+
+    def check_disk(self, folder):
+        try:
+            free = shutil.disk_usage(folder).free
+        except OSError:
+            return
+        if not self.paused and free < self.min_free_disk:
+            self.pause(f"only {format_size(free)} free in {folder}")
+        elif self.paused and free >= self.min_free_disk / RECOVER_RATIO:
+            self.resume(f"{format_size(free)} free in {folder} again")
+
+    @contextlib.asynccontextmanager
+    async def turn(self, job_count):
+        # Held after the job slot, a job waits here while the load keeps its slot away
+        if self.turns is None:
+            self.turns = asyncio.Condition()
+        async with self.turns:
+            await self.turns.wait_for(lambda: self.running < max(1, job_count - self.reduced))
+            self.running += 1
+        try:
+            yield
+        finally:
+            async with self.turns:
+                self.running -= 1
+                self.turns.notify_all()
+
+    async def check_load(self, engine):
+        load = os.getloadavg()[0] / cpu_count()
+        allowed = engine.job_count - self.reduced
+        if load > self.max_load and allowed > 1:
+            # Running encodes go on, one fewer starts once the next one finishes
+            self.reduced += 1
+            self.log(f"Governor: load {load:.2f} per core is over {self.max_load:g}, running at most {allowed - 1} job(s)")
+        elif load < self.max_load * RECOVER_RATIO and self.reduced:
+            await self.restore(1)
+            self.log(f"Governor: load {load:.2f} per core, running up to {allowed + 1} job(s) again")
+
+    async def restore(self, count):
+        self.reduced -= count
+        if self.turns:
+            async with self.turns:
+                self.turns.notify_all()
+
+    async def watch(self, engine, folder):
+        if self.max_load and not hasattr(os, "getloadavg"):
+            self.log("Governor: load average isn't available on this platform, ignoring --max-load")
+            self.max_load = None
+        if self.min_free_disk and not hasattr(signal, "SIGSTOP"):
+            self.log("Governor: encodes can't be paused on this platform, ignoring --min-free-disk")
+            self.min_free_disk = None
+        while True:
+            await asyncio.sleep(self.interval)
+            self.processes = {process for process in self.processes if process.returncode is None}
+            if self.min_free_disk:
+                self.check_disk(folder)
+            if self.max_load:
+                await self.check_load(engine)
+
+    def start(self, engine, folder):
+        # Decisions go to the run log of the engine being governed
+        self.log = engine.log
+        self.setup()
+        if self.max_load or self.min_free_disk:
+            self.task = asyncio.ensure_future(self.watch(engine, folder))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.reduced:
+            await self.restore(self.reduced)
+        if self.paused:
+            self.resume("stopping")
+        if self.cgroup:
+            self.remove_cgroup()
+            self.cgroup = None
@@ -0,0 +1,85 @@
+import os
+import threading
+from cache import read_json, write_json_atomic
+
+QUEUE_NAME = ".compress_queue.json"
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def temp_output_path(output_file):
+    # Same folder as the output so the final rename is atomic, same extension so
+    # ffmpeg still picks the right muxer
+    folder, name = os.path.split(os.path.abspath(output_file))
+    base, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{base}.partial{ext}")
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def commit_output(temp_file, output_file):
+    os.replace(temp_file, output_file)
+
+
+class JobQueue:
+    def __init__(self, input_files, output_files, params, retry_failed=False):
+        folder = os.path.dirname(os.path.abspath(output_files[0])) if output_files else os.getcwd()
+        self.path = os.path.join(folder, QUEUE_NAME)
+        self.lock = threading.Lock()
+        self.output_files = output_files
+        files = [[os.path.abspath(i), os.path.abspath(o)] for i, o in zip(input_files, output_files)]
+
+        data = read_json(self.path, {})
+        self.resumed = isinstance(data, dict) and data.get("files") == files and data.get("params") == params
+        if self.resumed:
+            self.states = data["states"]
+            self.errors = data.get("errors") or [None] * len(files)
+        else:
+            self.states = [PENDING] * len(files)
+            self.errors = [None] * len(files)
+        self.data = {"files": files, "params": params, "states": self.states, "errors": self.errors}
+
+        for idx, state in enumerate(self.states):
+            # A job still marked running was interrupted, its partial output is garbage
+            if state == RUNNING or (state == FAILED and retry_failed):
+                self.states[idx] = PENDING
+                self.errors[idx] = None
+                discard(temp_output_path(output_files[idx]))
+        self.save()
+
+    def pending(self):
+        return [idx for idx, state in enumerate(self.states) if state == PENDING]
+
+    def count(self, state):
+        return self.states.count(state)
+
+    def start(self, idx):
+        self.mark(idx, RUNNING)
+
+    def finish(self, idx, ok, error=None):
+        self.mark(idx, DONE if ok else FAILED, None if ok else (error or "compression failed"))
+
+    def mark(self, idx, state, error=None):
+        with self.lock:
+            self.states[idx] = state
+            self.errors[idx] = error
+            self.save()
+
+    def close(self):
+        # Keep the file only if there is something left to retry
+        with self.lock:
+            if all(state == DONE for state in self.states):
+                discard(self.path)
+
+    def save(self):
+        try:
+            write_json_atomic(self.path, self.data)
+        except OSError:
+            pass
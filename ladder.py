@@ -0,0 +1,63 @@
+import os
+from dataclasses import dataclass
+from scheduler import thread_args
+
+
+@dataclass
+class Rendition:
+    height: int
+    crf: int
+    suffix: str
+
+
+def parse_ladder(text, default_crf=None):
+    # "1080:20,720:22,480:24" or "720:22:hd" (height, CRF and name suffix, CRF falls back to --crf)
+    renditions = []
+    for part in text.split(","):
+        fields = part.strip().split(":")
+        if not fields[0] or len(fields) > 3:
+            raise ValueError(f"Invalid rendition: {part}")
+        height = int(fields[0].strip().lower().rstrip("p"))
+        crf = int(fields[1]) if len(fields) > 1 and fields[1] else default_crf
+        if crf is None:
+            raise ValueError(f"No CRF for the {height}p rendition")
+        suffix = fields[2] if len(fields) > 2 and fields[2] else f"{height}p"
+        renditions.append(Rendition(height, max(0, min(51, crf)), suffix))
+    if len({rendition.suffix for rendition in renditions}) != len(renditions):
+        raise ValueError("Every rendition needs its own name suffix")
+    return renditions
+
+
+def ladder_spec(renditions):
+    return ",".join(f"{r.height}:{r.crf}:{r.suffix}" for r in renditions)
+
+
+def rendition_path(output_file, rendition):
+    # x_compressed.mp4 -> x_720p_compressed.mp4, the watcher still knows it as one of ours
+    base, ext = os.path.splitext(output_file)
+    if base.endswith("_compressed"):
+        return f"{base[:-len('_compressed')]}_{rendition.suffix}_compressed{ext}"
+    return f"{base}_{rendition.suffix}{ext}"
+
+
+def renditions_for(renditions, height):
+    # Never upscale, but always produce at least the smallest rendition
+    fitting = [rendition for rendition in renditions if not height or rendition.height <= height]
+    return fitting or [min(renditions, key=lambda rendition: rendition.height)]
+
+
+def ladder_command(ffmpegcmd, input_file, outputs, preset, threads, jobs):
+    # One decode, split into a scaled x265 encode per rendition. outputs is [(rendition, path)].
+    count = len(outputs)
+    labels = "".join(f"[v{n}]" for n in range(count))
+    graph = [f"[0:v]split={count}{labels}"]
+    graph += [f"[v{n}]scale=-2:'min(ih,{rendition.height})'[o{n}]" for n, (rendition, _) in enumerate(outputs)]
+    # The encoders share the process, so they share the job's threads too
+    decode_args, encode_args = thread_args(max(1, threads // count), jobs * count)
+    command = [ffmpegcmd, *decode_args, "-i", input_file, "-filter_complex", ";".join(graph)]
+    for n, (rendition, output_file) in enumerate(outputs):
+        command += [
+            "-map", f"[o{n}]", "-map", "0:a?", "-vcodec", "libx265", "-crf", str(rendition.crf),
+            "-preset", preset, *encode_args, "-acodec", "copy", "-y", output_file
+        ]
+    return command
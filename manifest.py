@@ -0,0 +1,100 @@
+import os
+import hashlib
+import threading
+from cache import read_json, write_json_atomic
+
+MANIFEST_NAME = ".compress_manifest.json"
+MANIFEST_VERSION = 1
+PARTIAL_HASH_CHUNK = 1 << 20
+
+
+def partial_hash(path):
+    # Size plus the first, middle and last MiB: cheap no matter how big the file is
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - PARTIAL_HASH_CHUNK // 2), max(0, size - PARTIAL_HASH_CHUNK)):
+            f.seek(offset)
+            digest.update(f.read(PARTIAL_HASH_CHUNK))
+    return digest.hexdigest()
+
+
+def file_checksum(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(PARTIAL_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_identity(path):
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": partial_hash(path),
+    }
+
+
+class Manifest:
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        data = read_json(self.path, {})
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            data = {"version": MANIFEST_VERSION, "entries": {}}
+        self.data = data
+        self.entries = data["entries"]
+
+    def is_unchanged(self, input_file, output_file, params):
+        entry = self.entries.get(os.path.basename(output_file))
+        if not entry or entry["params"] != params or entry["input"]["path"] != os.path.abspath(input_file):
+            return False
+        try:
+            output_stat = os.stat(output_file)
+            input_stat = os.stat(input_file)
+        except OSError:
+            return False
+
+        output = entry["output"]
+        identity = entry["input"]
+        if output_stat.st_size != output["size"] or output_stat.st_mtime_ns != output["mtime_ns"]:
+            return False
+        if input_stat.st_size != identity["size"]:
+            return False
+        if input_stat.st_mtime_ns == identity["mtime_ns"]:
+            return True
+
+        # Touched or copied but maybe not changed, let the content decide
+        if partial_hash(input_file) != identity["hash"]:
+            return False
+        with self.lock:
+            identity["mtime_ns"] = input_stat.st_mtime_ns
+            self.save()
+        return True
+
+    def record(self, input_file, output_file, params):
+        output_stat = os.stat(output_file)
+        entry = {
+            "input": input_identity(input_file),
+            "params": params,
+            "output": {
+                "size": output_stat.st_size,
+                "mtime_ns": output_stat.st_mtime_ns,
+                "checksum": file_checksum(output_file),
+            },
+        }
+        with self.lock:
+            self.entries[os.path.basename(output_file)] = entry
+            self.save()
+
+    def orphans(self):
+        folder = os.path.dirname(self.path)
+        return [
+            os.path.join(folder, name) for name, entry in sorted(self.entries.items())
+            if not os.path.exists(entry["input"]["path"]) and os.path.exists(os.path.join(folder, name))
+        ]
+
+    def save(self):
+        write_json_atomic(self.path, self.data)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decision import SKIP
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@dataclass
+class JobMetrics:
+    idx: int
+    input_file: str
+    output_file: str
+    action: str = ""
+    ok: bool = False
+    exit_code: int = None
+    failure: str = ""
+    queue_wait: float = 0.0
+    probe_time: float = 0.0
+    # Auto CRF sample search, kept out of encode_wall so fps, speed and CPU time cover the same encode
+    crf_search: float = 0.0
+    encode_wall: float = 0.0
+    encode_cpu: float = 0.0
+    max_rss_kb: int = 0
+    frames: int = 0
+    duration: float = 0.0
+    avg_fps: float = 0.0
+    min_fps: float = 0.0
+    speed: float = 0.0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    finished_at: str = ""
+
+    def add_process(self, process):
+        # Called for every ffmpeg run of the job (segments, passes), CPU time adds up
+        self.encode_cpu += process.cpu_time
+        self.max_rss_kb = max(self.max_rss_kb, process.max_rss_kb)
+        if process.min_fps and (not self.min_fps or process.min_fps < self.min_fps):
+            self.min_fps = process.min_fps
+        if self.exit_code in (None, 0):
+            self.exit_code = process.returncode
+
+    def finish(self, result):
+        self.ok = result.ok
+        self.action = result.action
+        if not result.ok and self.exit_code:
+            self.failure = f"ffmpeg exited with code {self.exit_code}"
+        elif not result.ok:
+            self.failure = result.reason or "compression failed"
+        self.output_bytes = result.compressed_size
+        try:
+            self.input_bytes = os.path.getsize(self.input_file)
+        except OSError:
+            pass
+        if self.ok and self.encode_wall:
+            self.avg_fps = round(self.frames / self.encode_wall, 2)
+            self.speed = round(self.duration / self.encode_wall, 3)
+        self.queue_wait = round(self.queue_wait, 4)
+        self.probe_time = round(self.probe_time, 4)
+        self.crf_search = round(self.crf_search, 4)
+        self.encode_wall = round(self.encode_wall, 4)
+        self.encode_cpu = round(self.encode_cpu, 4)
+        self.finished_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class MetricsWriter:
+    def __init__(self, jsonl_path=None, textfile=None, port=None):
+        self.lock = threading.Lock()
+        self.textfile = textfile
+        self.started = time.monotonic()
+        self.jobs = {"done": 0, "failed": 0, "skipped": 0}
+        self.totals = {
+            "input_bytes": 0, "output_bytes": 0, "frames": 0, "media_seconds": 0.0,
+            "encode_seconds": 0.0, "encode_cpu_seconds": 0.0, "queue_wait_seconds": 0.0, "probe_seconds": 0.0,
+            "crf_search_seconds": 0.0,
+        }
+        self.jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self.server = None
+        if port:
+            try:
+                self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+            except OSError as e:
+                if self.jsonl:
+                    self.jsonl.close()
+                raise OSError(e.errno, f"can't listen on 127.0.0.1:{port}: {e.strerror or e}") from e
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.write_textfile()
+
+    def handler(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def record(self, job):
+        with self.lock:
+            status = "skipped" if job.action == SKIP else "done" if job.ok else "failed"
+            self.jobs[status] += 1
+            self.totals["input_bytes"] += job.input_bytes
+            self.totals["output_bytes"] += job.output_bytes
+            self.totals["frames"] += job.frames if job.ok else 0
+            self.totals["media_seconds"] += job.duration if job.ok else 0.0
+            self.totals["encode_seconds"] += job.encode_wall
+            self.totals["encode_cpu_seconds"] += job.encode_cpu
+            self.totals["queue_wait_seconds"] += job.queue_wait
+            self.totals["probe_seconds"] += job.probe_time
+            self.totals["crf_search_seconds"] += job.crf_search
+            if self.jsonl:
+                self.jsonl.write(json.dumps(asdict(job)) + "\n")
+                self.jsonl.flush()
+        self.write_textfile()
+
+    def render(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            lines = [
+                "# HELP krrsnk_jobs_total Jobs finished in this batch by status.",
+                "# TYPE krrsnk_jobs_total counter",
+            ]
+            lines += [f'krrsnk_jobs_total{{status="{status}"}} {count}' for status, count in self.jobs.items()]
+            for name, value in self.totals.items():
+                lines += [f"# TYPE krrsnk_{name}_total counter", f"krrsnk_{name}_total {value:g}"]
+            lines += [
+                "# HELP krrsnk_batch_elapsed_seconds Time since the batch started.",
+                "# TYPE krrsnk_batch_elapsed_seconds gauge",
+                f"krrsnk_batch_elapsed_seconds {elapsed:.3f}",
+                "# HELP krrsnk_throughput_frames_per_second Frames encoded per second of batch time.",
+                "# TYPE krrsnk_throughput_frames_per_second gauge",
+                f"krrsnk_throughput_frames_per_second {self.totals['frames'] / elapsed if elapsed else 0:.3f}",
+                "# HELP krrsnk_throughput_input_bytes_per_second Input bytes processed per second of batch time.",
+                "# TYPE krrsnk_throughput_input_bytes_per_second gauge",
+                f"krrsnk_throughput_input_bytes_per_second {self.totals['input_bytes'] / elapsed if elapsed else 0:.1f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        # node_exporter's textfile collector may read at any moment, so replace the file atomically
+        if not self.textfile:
+            return
+        tmp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.textfile)
+
+    def close(self):
+        self.write_textfile()
+        if self.jsonl:
+            self.jsonl.close()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
@@ -0,0 +1,80 @@
+import os
+import re
+from cache import cache_dir, read_json
+from scheduler import cpu_count
+
+# Fastest to slowest
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+PROFILE_VERSION = 1
+
+duration_pattern = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd]?)$')
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def profile_path():
+    return os.path.join(cache_dir(), "calibration.json")
+
+
+def load_profile(path=None):
+    # None when there is no profile or it was recorded on a machine with another core count
+    profile = read_json(path or profile_path())
+    if not isinstance(profile, dict) or profile.get("version") != PROFILE_VERSION or not profile.get("entries"):
+        return None
+    if profile.get("cpu_count") != cpu_count():
+        return None
+    return profile
+
+
+def parse_speed(text):
+    # "1.5x" or "1.5", times real time
+    value = float(text.strip().lower().rstrip("x"))
+    if value <= 0:
+        raise ValueError(f"Speed must be above 0: {text}")
+    return value
+
+
+def parse_deadline(text):
+    # "90m", "2h", "3600" (seconds) or "1:30:00"
+    text = text.strip().lower()
+    if ":" in text:
+        seconds = 0.0
+        for part in text.split(":"):
+            seconds = seconds * 60 + float(part)
+    else:
+        match = duration_pattern.match(text)
+        if not match:
+            raise ValueError(f"Unknown deadline: {text}")
+        seconds = float(match.group(1)) * DURATION_UNITS[match.group(2)]
+    if seconds <= 0:
+        raise ValueError(f"Deadline must be above 0: {text}")
+    return seconds
+
+
+def estimated_speed(entry, profile, height):
+    # x265 time grows roughly with the pixel count, the calibration clip keeps its aspect ratio
+    clip_height = profile["clip"]["height"]
+    if not height:
+        return entry["speed"]
+    return entry["speed"] * (clip_height / height) ** 2
+
+
+def pick_preset(profile, speed, height, files=1, jobs=None):
+    # Returns (entry, estimated speed, met) for the slowest preset that still reaches speed,
+    # or the fastest layout there is when none does
+    entries = [entry for entry in profile["entries"] if entry["jobs"] <= max(1, files)]
+    if jobs:
+        entries = [entry for entry in entries if entry["jobs"] == min(jobs, files)] or entries
+    if not entries:
+        return None, 0.0, False
+    best = None
+    for entry in entries:
+        estimated = estimated_speed(entry, profile, height)
+        if estimated < speed:
+            continue
+        rank = (PRESETS.index(entry["preset"]), estimated)
+        if best is None or rank > best[0]:
+            best = (rank, entry, estimated)
+    if best:
+        return best[1], best[2], True
+    fastest = max(entries, key=lambda entry: estimated_speed(entry, profile, height))
+    return fastest, estimated_speed(fastest, profile, height), False
@@ -0,0 +1,147 @@
+import os
+import json
+import asyncio
+from cache import JsonCache, file_key
+from scheduler import run_command
+
+PROBE_CACHE_VERSION = 1
+PREREAD_CHUNK = 1 << 20
+
+_probe_cache = None
+
+
+def get_probe_cache():
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = JsonCache("probe_cache.json")
+    return _probe_cache
+
+
+def parse_rate(value):
+    try:
+        if "/" in value:
+            num, den = value.split("/", 1)
+            return float(num) / float(den) if float(den) else 0.0
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+async def run_ffprobe(ffprobecmd, args, input_file):
+    command = [ffprobecmd, "-v", "error"] + args + ["-of", "json", input_file]
+    _, stdout, _ = await run_command(command)
+    try:
+        return json.loads(stdout)
+    except json.JSONDecodeError:
+        return {}
+
+
+async def read_metadata(input_file, ffprobecmd):
+    probe_data = await run_ffprobe(ffprobecmd, [
+        "-show_entries",
+        "format=duration,size,bit_rate,format_name:"
+        "stream=index,codec_type,codec_name,width,height,nb_frames,avg_frame_rate,duration,bit_rate",
+    ], input_file)
+
+    fmt = probe_data.get("format", {})
+    streams = probe_data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = [s for s in streams if s.get("codec_type") == "audio"]
+
+    duration = to_float(video.get("duration")) or to_float(fmt.get("duration"))
+    return {
+        "frames": to_int(video.get("nb_frames")),
+        "frames_source": "nb_frames",
+        "duration": duration,
+        "fps": parse_rate(video.get("avg_frame_rate")),
+        "width": to_int(video.get("width")),
+        "height": to_int(video.get("height")),
+        "codec": video.get("codec_name", ""),
+        "video_bit_rate": to_int(video.get("bit_rate")),
+        "audio_bit_rate": sum(to_int(s.get("bit_rate")) for s in audio),
+        "audio_streams": len(audio),
+        "format": fmt.get("format_name", ""),
+        "bit_rate": to_int(fmt.get("bit_rate")),
+        "size": to_int(fmt.get("size")) or os.path.getsize(input_file),
+    }
+
+
+async def count_stream(input_file, ffprobecmd, what):
+    # what is "packets" (demux only, cheap) or "frames" (full decode, slow)
+    probe_data = await run_ffprobe(ffprobecmd, [
+        "-select_streams", "v:0", f"-count_{what}", "-show_entries", f"stream=nb_read_{what}",
+    ], input_file)
+    try:
+        return int(probe_data["streams"][0][f"nb_read_{what}"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return 0
+
+
+async def probe_video(input_file, ffprobecmd="ffprobe", log=None, use_cache=True, allow_decode=True):
+    log = log or (lambda message: None)
+    try:
+        key = f"v{PROBE_CACHE_VERSION}|{file_key(input_file)}"
+    except OSError:
+        key = None
+
+    if use_cache and key:
+        cached = get_probe_cache().get(key)
+        if cached:
+            return cached
+
+    log(f"Probing video {input_file}...")
+    info = await read_metadata(input_file, ffprobecmd)
+
+    if info["frames"] <= 0 and info["duration"] > 0 and info["fps"] > 0:
+        info["frames"] = int(round(info["duration"] * info["fps"]))
+        info["frames_source"] = "duration"
+
+    if info["frames"] <= 0:
+        info["frames"] = await count_stream(input_file, ffprobecmd, "packets")
+        info["frames_source"] = "packets"
+
+    if info["frames"] <= 0 and allow_decode:
+        log(f"No frame count in metadata of {input_file}, counting decoded frames...")
+        info["frames"] = await count_stream(input_file, ffprobecmd, "frames")
+        info["frames_source"] = "decode"
+
+    if info["frames"] <= 0:
+        info["frames"] = 0
+        info["frames_source"] = ""
+
+    if use_cache and key and (info["frames"] or info["duration"]):
+        get_probe_cache().set(key, info)
+    return info
+
+
+def read_into_cache(input_file):
+    # Gets the file into the page cache before the encoder asks for it
+    with open(input_file, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return
+        while f.read(PREREAD_CHUNK):
+            pass
+
+
+async def preread(input_file):
+    await asyncio.to_thread(read_into_cache, input_file)
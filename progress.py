@@ -0,0 +1,163 @@
+import os
+import re
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from probe import format_time
+from scheduler import start_process
+
+STDERR_TAIL_LINES = 50
+
+# -benchmark makes ffmpeg print its own rusage when it exits
+bench_time_pattern = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+bench_rss_pattern = re.compile(r'bench: maxrss=(\d+)')
+
+
+@dataclass
+class ProgressEvent:
+    frame: int = 0
+    fps: float = 0.0
+    bitrate: float = 0.0
+    out_time: float = 0.0
+    speed: float = 0.0
+    total_size: int = 0
+    done: bool = False
+
+
+def number(value, cast=float):
+    value = value.strip().rstrip("x").replace("kbits/s", "")
+    try:
+        return cast(value)
+    except ValueError:
+        return cast(0)
+
+
+def parse_progress_block(fields):
+    out_time_us = number(fields.get("out_time_us", "0"), int)
+    return ProgressEvent(
+        frame=number(fields.get("frame", "0"), int),
+        fps=number(fields.get("fps", "0")),
+        bitrate=number(fields.get("bitrate", "0")),
+        out_time=max(0.0, out_time_us / 1000000),
+        speed=number(fields.get("speed", "0")),
+        total_size=number(fields.get("total_size", "0"), int),
+        done=fields.get("progress") == "end",
+    )
+
+
+def progress_position(event, total_frames, duration):
+    if total_frames:
+        return min(event.frame, total_frames), total_frames
+    if duration:
+        return int(min(event.out_time, duration) * 1000), int(duration * 1000)
+    return None
+
+
+def describe_progress(event, total_frames, duration):
+    if total_frames:
+        position = f"Current frame: {event.frame}/{total_frames}"
+    elif duration:
+        position = f"Current time: {format_time(min(event.out_time, duration))}/{format_time(duration)}"
+    else:
+        position = f"Current time: {format_time(event.out_time)}"
+    return f"{position} ({event.fps:.1f} fps, {event.speed:.2f}x)"
+
+
+progress_line_pattern = re.compile(r'^\w+=')
+
+
+class FFmpegProcess:
+    def __init__(self, command, on_progress=None, tail_lines=STDERR_TAIL_LINES, cwd=None, on_exit=None, stdin=None, stdout=None):
+        self.command = [command[0], "-hide_banner", "-nostats", "-benchmark", *command[1:]]
+        self.on_progress = on_progress or (lambda event: None)
+        self.on_exit = on_exit or (lambda process: None)
+        self.stderr_tail = deque(maxlen=tail_lines)
+        self.last_event = ProgressEvent()
+        self.min_fps = 0.0
+        self.cpu_time = 0.0
+        self.max_rss_kb = 0
+        self.returncode = None
+        self.cwd = cwd
+        # Handed to ffmpeg as they are when it streams from stdin or to stdout (pipe:0 / pipe:1)
+        self.stdin = stdin
+        self.stdout = stdout
+        self.progress_fd = None
+        self.progress_reader = None
+        self.process = None
+
+    async def drain_stderr(self, stream):
+        try:
+            async for raw in stream:
+                line = raw.decode("utf-8", "replace").rstrip()
+                if self.progress_reader is not None and progress_line_pattern.match(line):
+                    self.progress_reader.feed_data(raw)
+                    continue
+                bench_time = bench_time_pattern.search(line)
+                bench_rss = bench_rss_pattern.search(line)
+                if bench_time:
+                    self.cpu_time = float(bench_time.group(1)) + float(bench_time.group(2))
+                elif bench_rss:
+                    self.max_rss_kb = int(bench_rss.group(1))
+                elif line:
+                    self.stderr_tail.append(line)
+        finally:
+            if self.progress_reader is not None:
+                self.progress_reader.feed_eof()
+
+    async def read_progress(self, stream):
+        fields = {}
+        async for raw in stream:
+            key, _, value = raw.decode("ascii", "replace").strip().partition("=")
+            fields[key] = value
+            if key == "progress":
+                self.last_event = parse_progress_block(fields)
+                # ffmpeg reports 0 fps until the first frames are out
+                if self.last_event.fps and (not self.min_fps or self.last_event.fps < self.min_fps):
+                    self.min_fps = self.last_event.fps
+                self.on_progress(self.last_event)
+                fields = {}
+
+    async def open_progress(self):
+        # Returns the -progress target, extra subprocess arguments and a callback giving its reader
+        if self.stdout is None:
+            return "pipe:1", {}, lambda: self.process.stdout
+        if os.name == "posix":
+            # stdout carries the video, progress gets a pipe of its own
+            read_fd, write_fd = os.pipe()
+            reader = asyncio.StreamReader()
+            loop = asyncio.get_running_loop()
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb"))
+            self.progress_fd = write_fd
+            return f"pipe:{write_fd}", {"pass_fds": (write_fd,)}, lambda: reader
+        # No fd inheritance on Windows, progress lines are picked out of stderr instead
+        self.progress_reader = asyncio.StreamReader()
+        return "pipe:2", {}, lambda: self.progress_reader
+
+    async def run(self):
+        target, extra, progress_stream = await self.open_progress()
+        command = [self.command[0], "-progress", target, *self.command[1:]]
+        try:
+            self.process = await start_process(
+                command, stdin=asyncio.subprocess.DEVNULL if self.stdin is None else self.stdin,
+                stdout=asyncio.subprocess.PIPE if self.stdout is None else self.stdout,
+                stderr=asyncio.subprocess.PIPE, cwd=self.cwd, **extra
+            )
+        finally:
+            if self.progress_fd is not None:
+                # Only ffmpeg keeps the write end, so the reader sees EOF when it exits
+                os.close(self.progress_fd)
+                self.progress_fd = None
+        try:
+            await asyncio.gather(self.read_progress(progress_stream()), self.drain_stderr(self.process.stderr))
+            self.returncode = await self.process.wait()
+            self.on_exit(self)
+        except asyncio.CancelledError:
+            # Don't leave an orphaned encoder behind when the job is cancelled
+            if self.process.returncode is None:
+                self.process.kill()
+                await self.process.wait()
+            raise
+        return self.returncode
+
+    def tail(self):
+        return list(self.stderr_tail)
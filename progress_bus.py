@@ -0,0 +1,76 @@
+import os
+import threading
+from datetime import datetime
+from cache import cache_dir
+
+FLUSH_INTERVAL = 0.1
+VISIBLE_LOG_LINES = 1000
+
+
+def new_log_path():
+    folder = os.path.join(cache_dir(), "logs")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, datetime.now().strftime("compress-%Y%m%d-%H%M%S.log"))
+
+
+class ProgressBus:
+    # Collects progress, log lines and completions from worker threads and hands
+    # them to the UI thread in batches: progress is coalesced to the latest value
+    # per job, so the UI sees at most one update per job per flush.
+    def __init__(self, log_path=None, interval=FLUSH_INTERVAL):
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.pending_progress = {}
+        self.pending_logs = []
+        self.pending_complete = []
+        self.log_path = log_path
+        self.log_file = open(log_path, "a", encoding="utf-8", buffering=1) if log_path else None
+        self.flusher = None
+        self.stopped = threading.Event()
+
+    def progress(self, current, total, idx):
+        with self.lock:
+            self.pending_progress[idx] = (current, total)
+
+    def log(self, message):
+        with self.lock:
+            self.pending_logs.append(message)
+            if self.log_file:
+                self.log_file.write(f"{datetime.now():%H:%M:%S} {message}\n")
+
+    def complete(self, *args):
+        with self.lock:
+            self.pending_complete.append(args)
+
+    def drain(self):
+        with self.lock:
+            batch = (self.pending_progress, self.pending_logs, self.pending_complete)
+            self.pending_progress, self.pending_logs, self.pending_complete = {}, [], []
+        return batch
+
+    def start(self, deliver):
+        # For toolkits where emitting from a thread is safe (Qt queued signals)
+        def loop():
+            while not self.stopped.wait(self.interval):
+                self.flush(deliver)
+            self.flush(deliver)
+
+        self.stopped.clear()
+        self.flusher = threading.Thread(target=loop, daemon=True)
+        self.flusher.start()
+
+    def flush(self, deliver):
+        progress, logs, complete = self.drain()
+        if progress or logs or complete:
+            deliver(progress, logs, complete)
+
+    def close(self):
+        if self.flusher:
+            self.stopped.set()
+            self.flusher.join()
+            self.flusher = None
+        with self.lock:
+            if self.log_file:
+                self.log_file.close()
+                self.log_file = None
+
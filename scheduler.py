@@ -0,0 +1,111 @@
+import os
+import shutil
+import asyncio
+import subprocess
+import contextvars
+
+# Rough number of threads one x265 instance keeps busy at a given height.
+# Above that, extra threads mostly wait on each other (WPP rows / frame deps).
+X265_USEFUL_THREADS = [
+    (480, 4),
+    (720, 8),
+    (1080, 16),
+    (1440, 24),
+]
+X265_MAX_USEFUL_THREADS = 32
+
+IO_PRIORITIES = {
+    "normal": [],
+    "low": ["-c", "2", "-n", "7"],
+    "idle": ["-c", "3"],
+}
+
+# (nice, io) for the helper processes (probes, sample encodes) a task starts.
+# Tasks copy it when they are created, so the look-ahead can lower it for
+# everything it runs without touching the encodes.
+helper_priority = contextvars.ContextVar("helper_priority", default=(0, "normal"))
+# Resource governor the ffmpeg/ffprobe processes of a task are started under, see governor.py
+active_governor = contextvars.ContextVar("active_governor", default=None)
+
+
+def cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def useful_threads(height):
+    for max_height, threads in X265_USEFUL_THREADS:
+        if height and height <= max_height:
+            return threads
+    return X265_MAX_USEFUL_THREADS
+
+
+def plan_jobs(heights, jobs=None, cores=None, count=None):
+    # heights may only cover the first files of the batch, count is the whole batch
+    cores = cores or cpu_count()
+    count = max(1, count or len(heights))
+    if jobs and jobs > 0:
+        jobs = min(jobs, count)
+    else:
+        widest = max(heights) if heights else 0
+        jobs = max(1, min(count, cores // useful_threads(widest)))
+    threads = max(1, cores // jobs)
+    return jobs, threads
+
+
+def thread_args(threads, jobs):
+    # A single job keeps x265's own defaults, it already sizes itself to the machine
+    if jobs <= 1:
+        return [], []
+    frame_threads = max(1, min(6, threads // 4))
+    decode_args = ["-threads", str(max(1, min(threads, 4)))]
+    encode_args = ["-x265-params", f"pools={threads}:frame-threads={frame_threads}"]
+    return decode_args, encode_args
+
+
+def low_priority(command, nice=0, io="normal"):
+    # Returns the command and extra subprocess arguments that start it below normal priority
+    if os.name == "nt":
+        if nice >= 15:
+            return command, {"creationflags": subprocess.IDLE_PRIORITY_CLASS}
+        if nice > 0:
+            return command, {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+        return command, {}
+    prefix = []
+    if IO_PRIORITIES.get(io) and shutil.which("ionice"):
+        prefix += ["ionice", *IO_PRIORITIES[io]]
+    if nice > 0 and shutil.which("nice"):
+        prefix += ["nice", "-n", str(nice)]
+    return prefix + list(command), {}
+
+
+async def start_process(command, **kwargs):
+    # Every ffmpeg and ffprobe is started here, so priorities and limits apply to all of them
+    command, extra = low_priority(command, *helper_priority.get())
+    governor = active_governor.get()
+    if governor:
+        command, extra = governor.prepare(command, extra)
+    process = await asyncio.create_subprocess_exec(*command, **kwargs, **extra)
+    if governor:
+        governor.attach(process)
+    return process
+
+
+async def run_command(command, cwd=None):
+    process = await start_process(
+        command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE, cwd=cwd
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+
+async def gather_limited(coroutines, limit, return_exceptions=False):
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def guarded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(guarded(coroutine) for coroutine in coroutines), return_exceptions=return_exceptions)
@@ -0,0 +1,23 @@
+import pytest
+from autocrf import parse_target, sample_starts, DEFAULT_TARGET
+
+
+def test_parse_target():
+    assert parse_target("ssim:0.98") == ("ssim", 0.98)
+    assert parse_target("PSNR:42") == ("psnr", 42.0)
+    assert parse_target("size:2") == ("size", 2 * 1024 * 1024)
+
+
+def test_parse_target_default():
+    assert parse_target(None) == parse_target(DEFAULT_TARGET)
+
+
+@pytest.mark.parametrize("text", ["vmaf:95", "ssim", "ssim:high"])
+def test_parse_target_invalid(text):
+    with pytest.raises(ValueError):
+        parse_target(text)
+
+
+def test_sample_starts():
+    assert sample_starts(10.0) == [0.0]
+    assert sample_starts(100.0, count=4, length=4) == [18.0, 38.0, 58.0, 78.0]
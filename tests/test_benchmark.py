@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+from benchmark import compare, PeakRss
+
+
+def test_compare_flags_regressions_over_tolerance():
+    baseline = {"a/encode": {"wall_time": 1.0, "fps": 100.0, "peak_rss_kb": 1000}}
+    results = {"a/encode": {"wall_time": 1.5, "fps": 66.0, "peak_rss_kb": 1050}}
+    regressions = compare(results, baseline, 0.10)
+    assert [line.split(":")[0] for line in regressions] == ["a/encode wall_time", "a/encode fps"]
+
+
+def test_compare_ignores_startup_noise_and_missing_values():
+    baseline = {"progress": {"wall_time": 0.01, "peak_rss_kb": None}, "startup/compressQT": {"window_shown": 0.5}}
+    results = {"progress": {"wall_time": 0.03, "peak_rss_kb": None}, "startup/compressQT": {"window_shown": 0.8}}
+    assert compare(results, baseline, 0.10) == ["startup/compressQT window_shown: 0.5 -> 0.8 (+60.0%)"]
+
+
+def test_peak_rss_keeps_the_largest_process():
+    peak = PeakRss()
+    for max_rss_kb in (300, 900, 500):
+        peak.record(SimpleNamespace(max_rss_kb=max_rss_kb))
+    assert peak.peak_kb == 900
@@ -0,0 +1,20 @@
+from chunked import pick_boundaries
+
+
+def test_picks_candidates_closest_to_even_splits():
+    candidates = [float(time) for time in range(0, 300, 10)]
+    assert pick_boundaries(candidates, 300.0, 3) == [100.0, 200.0]
+
+
+def test_keeps_segments_long_enough():
+    assert pick_boundaries([40.0, 65.0], 100.0, 2, min_length=30) == [40.0]
+    assert pick_boundaries([40.0, 65.0], 100.0, 2, min_length=45) == []
+
+
+def test_no_candidates():
+    assert pick_boundaries([], 300.0, 4) == []
+
+
+def test_boundaries_only_go_forward():
+    # Only one keyframe in the middle, every later target would pick it again
+    assert pick_boundaries([150.0], 300.0, 4) == [150.0]
@@ -0,0 +1,49 @@
+import asyncio
+from decision import decide, bits_per_pixel, ENCODE, REMUX, SKIP
+
+
+def info(codec="h264", video_bit_rate=0, size=100 * 1024 * 1024, width=1920, height=1080, fps=30.0):
+    return {"codec": codec, "video_bit_rate": video_bit_rate, "bit_rate": 0, "audio_bit_rate": 0,
+            "width": width, "height": height, "fps": fps, "size": size}
+
+
+def run(*args, **kwargs):
+    return asyncio.run(decide(*args, **kwargs))[0]
+
+
+def estimate_to(size):
+    async def estimate():
+        return size
+    return estimate
+
+
+def test_bits_per_pixel():
+    assert bits_per_pixel(info(video_bit_rate=1920 * 1080 * 30)) == 1.0
+    assert bits_per_pixel(info(video_bit_rate=0)) == 0.0
+
+
+def test_unknown_bitrate_is_encoded():
+    assert run(info()) == ENCODE
+
+
+def test_efficient_codec_at_low_bitrate_is_kept():
+    low = info("hevc", video_bit_rate=2_000_000)
+    assert run(low) == REMUX
+    assert run(low, skip_efficient=True) == SKIP
+
+
+def test_high_bitrate_is_encoded():
+    assert run(info("hevc", video_bit_rate=20_000_000)) == ENCODE
+
+
+def test_sample_estimate_decides_in_between():
+    middle = info("h264", video_bit_rate=4_000_000, size=100)
+    assert run(middle, 20, estimate=estimate_to(95)) == REMUX
+    assert run(middle, 20, estimate=estimate_to(50)) == ENCODE
+    # No CRF to estimate with (auto CRF), so the file is encoded
+    assert run(middle, None, estimate=estimate_to(95)) == ENCODE
+
+
+def test_target_size():
+    assert run(info(size=50), target_size=100) == REMUX
+    assert run(info(size=150), target_size=100) == ENCODE
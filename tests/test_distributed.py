@@ -0,0 +1,60 @@
+import time
+import socket
+import threading
+import pytest
+from http.server import ThreadingHTTPServer
+from distributed import Coordinator, Worker, LEASED, PENDING
+
+
+def serve(coordinator):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), coordinator.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_worker_stops_on_a_wrong_token():
+    server, url = serve(Coordinator([], [], {}, token="secret"))
+    logs = []
+    try:
+        assert Worker(url, token="wrong", log=logs.append).start() is False
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert any("rejected the token" in line for line in logs)
+
+
+def coordinator_with_task(lease_timeout):
+    coordinator = Coordinator(["a.mp4"], ["out/a.mp4"], {}, lease_timeout=lease_timeout)
+    coordinator.files[0] = {"input": "a.mp4", "output": "out/a.mp4", "tasks": [], "state": "encoding", "work_dir": None}
+    coordinator.add_task(0, "a.mp4")
+    coordinator.workers["w1"] = {"name": "w1", "seen": time.monotonic()}
+    return coordinator
+
+
+def test_touch_keeps_the_lease():
+    coordinator = coordinator_with_task(lease_timeout=0.2)
+    task = coordinator.lease("w1")
+    time.sleep(0.15)
+    coordinator.touch(task)
+    time.sleep(0.1)
+    coordinator.reap()
+    assert task["state"] == LEASED and "w1" in coordinator.workers
+
+
+def test_expired_lease_is_requeued():
+    coordinator = coordinator_with_task(lease_timeout=0.05)
+    task = coordinator.lease("w1")
+    time.sleep(0.1)
+    coordinator.reap()
+    assert task["state"] == PENDING and task["attempts"] == 1
+
+
+def test_busy_coordinator_address_raises_oserror(tmp_path):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        coordinator = Coordinator([str(tmp_path / "a.mp4")], [str(tmp_path / "out" / "a.mp4")], {}, port=port)
+        with pytest.raises(OSError, match=f"127.0.0.1:{port}"):
+            coordinator.start()
+    assert not (tmp_path / "out").exists()
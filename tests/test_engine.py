@@ -0,0 +1,50 @@
+import os
+import stat
+import shutil
+import asyncio
+import pytest
+import probe
+from engine import CompressionEngine
+
+# Prints nothing for a file that isn't there, like ffprobe
+FAKE_FFPROBE = """#!/bin/sh
+for arg; do last=$arg; done
+[ -f "$last" ] && echo '{"format": {"duration": "1", "size": "4096"}, "streams": [{"codec_type": "video", "nb_frames": "30", "height": "720"}]}'
+"""
+# Writes something to the output (the last argument) like a successful encode
+FAKE_FFMPEG = """#!/bin/sh
+for arg; do last=$arg; done
+echo encoded > "$last"
+"""
+
+
+def tool(folder, name, script):
+    path = folder / name
+    path.write_text(script)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+PROFILE = {"clip": {"height": 720}, "entries": [{"preset": "ultrafast", "jobs": 1, "speed": 100.0}]}
+
+
+@pytest.mark.skipif(os.name != "posix" or not shutil.which("sh"), reason="fake ffmpeg needs a POSIX shell")
+@pytest.mark.parametrize("options", [{"lookahead": 0}, {"deadline": 60.0, "profile": PROFILE}, {}])
+def test_missing_input_fails_only_its_job(tmp_path, monkeypatch, options):
+    monkeypatch.setenv("KRRSNK_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(probe, "_probe_cache", None)
+    (tmp_path / "a.mp4").write_bytes(b"v" * 4096)
+    input_files = [str(tmp_path / "a.mp4"), str(tmp_path / "missing.mp4")]
+    output_files = [str(tmp_path / "out" / "a_compressed.mp4"), str(tmp_path / "out" / "missing_compressed.mp4")]
+    os.makedirs(tmp_path / "out")
+
+    async def run():
+        engine = CompressionEngine(
+            20, "ultrafast", tool(tmp_path, "ffmpeg", FAKE_FFMPEG), tool(tmp_path, "ffprobe", FAKE_FFPROBE),
+            always_encode=True, **options
+        )
+        return await engine.run_batch(input_files, output_files)
+
+    results = asyncio.run(run())
+    assert [result.ok for result in results] == [True, False]
+    assert os.path.exists(output_files[0])
@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+import governor
+from governor import Governor, parse_size, parse_cpus
+
+
+@pytest.mark.parametrize("text, size", [("512M", 512 << 20), ("4G", 4 << 30), ("4GiB", 4 << 30), ("1.5k", 1536), ("100", 100)])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+def test_parse_size_invalid():
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_parse_cpus(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    assert parse_cpus("0-3,6") == {0, 1, 2, 3, 6}
+    assert parse_cpus("2") == {2}
+    with pytest.raises(ValueError):
+        parse_cpus("a-b")
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="needs CPU affinity")
+def test_parse_cpus_rejects_cpus_we_cant_use():
+    available = os.sched_getaffinity(0)
+    assert parse_cpus(str(min(available))) == {min(available)}
+    with pytest.raises(ValueError, match="not available"):
+        parse_cpus(str(max(available) + 1000))
+
+
+def test_no_limits_leave_the_command_alone():
+    assert Governor().confine(["ffmpeg", "-i", "a.mp4"]) == ["ffmpeg", "-i", "a.mp4"]
+
+
+@pytest.mark.skipif(os.name != "posix" or not shutil.which("sh"), reason="needs a POSIX shell")
+def test_memory_limit_applies_from_the_start():
+    limited = Governor(memory_max=512 << 20)
+    limited.rlimit = True
+    command, _ = limited.prepare(["sh", "-c", "ulimit -v"], {})
+    assert subprocess.run(command, capture_output=True, text=True).stdout.strip() == str(512 << 10)
+
+
+@pytest.fixture
+def fake_cgroup(tmp_path, monkeypatch):
+    if not sys.platform.startswith("linux"):
+        pytest.skip("cgroups are Linux only")
+    with open("/proc/self/cgroup") as f:
+        own = next((line[3:].strip() for line in f if line.startswith("0::")), None)
+    if own is None:
+        pytest.skip("no cgroup v2 entry for this process")
+    base = tmp_path / own.strip("/")
+    base.mkdir(parents=True, exist_ok=True)
+    (tmp_path / "cgroup.controllers").write_text("cpu memory io\n")
+    monkeypatch.setattr(governor, "CGROUP_ROOT", str(tmp_path))
+    return base
+
+
+def test_cgroup_only_undoes_the_controllers_it_enabled(fake_cgroup):
+    (fake_cgroup / "cgroup.subtree_control").write_text("cpu io\n")
+    limited = Governor(memory_max=1 << 30)
+    encodes, reason = limited.create_cgroup()
+    assert reason is None and encodes.endswith("-encodes")
+    assert (fake_cgroup / "cgroup.subtree_control").read_text() == "+memory"
+    limited.remove_cgroup()
+    assert (fake_cgroup / "cgroup.subtree_control").read_text() == "-memory"
+
+
+def test_cgroup_leaves_enabled_controllers_on(fake_cgroup):
+    (fake_cgroup / "cgroup.subtree_control").write_text("cpu memory\n")
+    limited = Governor(cpu_max=2)
+    limited.create_cgroup()
+    limited.remove_cgroup()
+    assert (fake_cgroup / "cgroup.subtree_control").read_text() == "cpu memory\n"
@@ -0,0 +1,44 @@
+import pytest
+from ladder import Rendition, parse_ladder, ladder_spec, rendition_path, renditions_for, ladder_command
+
+
+def test_parse_ladder():
+    assert parse_ladder("1080:20,720p:22,480:24:sd") == [
+        Rendition(1080, 20, "1080p"), Rendition(720, 22, "720p"), Rendition(480, 24, "sd")
+    ]
+
+
+def test_parse_ladder_crf_falls_back_and_is_clamped():
+    assert parse_ladder("720,480:60", default_crf=23) == [Rendition(720, 23, "720p"), Rendition(480, 51, "480p")]
+
+
+@pytest.mark.parametrize("text", ["720", "abc:20", "720:20:a:b", ":20", "720:20:hd,480:24:hd"])
+def test_parse_ladder_invalid(text):
+    with pytest.raises(ValueError):
+        parse_ladder(text)
+
+
+def test_ladder_spec_round_trips():
+    renditions = parse_ladder("1080:20,720:22:hd")
+    assert parse_ladder(ladder_spec(renditions)) == renditions
+
+
+def test_rendition_path():
+    rendition = Rendition(720, 22, "720p")
+    assert rendition_path("out/a_compressed.mp4", rendition) == "out/a_720p_compressed.mp4"
+    assert rendition_path("out/a.mp4", rendition) == "out/a_720p.mp4"
+
+
+def test_renditions_for_never_upscales():
+    renditions = parse_ladder("1080:20,720:22,480:24")
+    assert [r.height for r in renditions_for(renditions, 720)] == [720, 480]
+    assert [r.height for r in renditions_for(renditions, 360)] == [480]
+    assert renditions_for(renditions, 0) == renditions
+
+
+def test_ladder_command_has_one_output_per_rendition():
+    outputs = [(Rendition(720, 22, "720p"), "a_720p.mp4"), (Rendition(480, 24, "480p"), "a_480p.mp4")]
+    command = ladder_command("ffmpeg", "a.mp4", outputs, "slow", 8, 1)
+    assert command.count("-map") == 4
+    assert command[command.index("-filter_complex") + 1].startswith("[0:v]split=2[v0][v1]")
+    assert command[-1] == "a_480p.mp4"
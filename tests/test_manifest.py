@@ -0,0 +1,44 @@
+import asyncio
+import os
+from engine import CompressionEngine, COMPLETE
+from manifest import Manifest, MANIFEST_NAME
+
+
+def make_files(tmp_path):
+    input_file, output_file = tmp_path / "a.mp4", tmp_path / "out" / "a_compressed.mp4"
+    output_file.parent.mkdir()
+    input_file.write_bytes(b"i" * 4096)
+    output_file.write_bytes(b"o" * 1024)
+    return str(input_file), str(output_file)
+
+
+def test_record_and_is_unchanged(tmp_path):
+    input_file, output_file = make_files(tmp_path)
+    manifest = Manifest(os.path.dirname(output_file))
+    manifest.record(input_file, output_file, {"crf": 20})
+    assert Manifest(os.path.dirname(output_file)).is_unchanged(input_file, output_file, {"crf": 20})
+    assert not manifest.is_unchanged(input_file, output_file, {"crf": 22})
+
+
+def test_touched_input_with_same_content_is_unchanged(tmp_path):
+    input_file, output_file = make_files(tmp_path)
+    manifest = Manifest(os.path.dirname(output_file))
+    manifest.record(input_file, output_file, {"crf": 20})
+    os.utime(input_file, ns=(1, 1))
+    assert manifest.is_unchanged(input_file, output_file, {"crf": 20})
+
+
+def test_report_complete_records_the_output(tmp_path):
+    input_file, output_file = make_files(tmp_path)
+
+    async def complete():
+        engine = CompressionEngine(20, manifest=Manifest(os.path.dirname(output_file)))
+        events = engine.subscribe()
+        result = await engine.report_complete(0, input_file, output_file, "encode", "test")
+        engine.close()
+        return result, [event async for event in events]
+
+    result, events = asyncio.run(complete())
+    assert result.ok and result.compressed_size == 1024
+    assert [event.kind for event in events] == [COMPLETE]
+    assert os.path.exists(os.path.join(os.path.dirname(output_file), MANIFEST_NAME))
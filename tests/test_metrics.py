@@ -0,0 +1,27 @@
+import socket
+import pytest
+from engine import JobResult
+from metrics import MetricsWriter, JobMetrics
+
+
+def test_port_in_use_raises_oserror(tmp_path):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        with pytest.raises(OSError, match=f"127.0.0.1:{port}"):
+            MetricsWriter(str(tmp_path / "jobs.jsonl"), port=port)
+
+
+def test_crf_search_stays_out_of_the_encode_numbers(tmp_path):
+    input_file = tmp_path / "a.mp4"
+    input_file.write_bytes(b"v" * 100)
+    job = JobMetrics(0, str(input_file), "out.mp4", frames=300, duration=10.0, crf_search=20.0, encode_wall=5.0)
+    job.finish(JobResult(0, str(input_file), "out.mp4", True, compressed_size=50))
+    assert (job.avg_fps, job.speed, job.crf_search) == (60.0, 2.0, 20.0)
+
+    writer = MetricsWriter(textfile=str(tmp_path / "batch.prom"))
+    writer.record(job)
+    text = (tmp_path / "batch.prom").read_text()
+    assert "krrsnk_crf_search_seconds_total 20" in text
+    assert "krrsnk_encode_seconds_total 5" in text
@@ -0,0 +1,55 @@
+import pytest
+from presets import pick_preset, parse_speed, parse_deadline, estimated_speed
+
+PROFILE = {
+    "clip": {"height": 720},
+    "entries": [
+        {"preset": "fast", "jobs": 1, "speed": 4.0},
+        {"preset": "medium", "jobs": 1, "speed": 2.0},
+        {"preset": "slow", "jobs": 1, "speed": 1.0},
+        {"preset": "slow", "jobs": 2, "speed": 1.8},
+    ],
+}
+
+
+def test_picks_the_slowest_preset_that_is_fast_enough():
+    entry, estimated, met = pick_preset(PROFILE, 1.5, 720, files=1)
+    assert (entry["preset"], entry["jobs"], estimated, met) == ("medium", 1, 2.0, True)
+
+
+def test_more_files_allow_more_jobs():
+    entry, _, met = pick_preset(PROFILE, 1.5, 720, files=4)
+    assert (entry["preset"], entry["jobs"], met) == ("slow", 2, True)
+
+
+def test_explicit_jobs_restrict_the_layouts():
+    entry, _, _ = pick_preset(PROFILE, 1.5, 720, files=4, jobs=1)
+    assert (entry["preset"], entry["jobs"]) == ("medium", 1)
+
+
+def test_falls_back_to_the_fastest_when_nothing_is_fast_enough():
+    # 1440p is four times the pixels of the 720p clip
+    entry, estimated, met = pick_preset(PROFILE, 2.0, 1440, files=1)
+    assert (entry["preset"], estimated, met) == ("fast", 1.0, False)
+
+
+def test_estimated_speed_without_height():
+    assert estimated_speed(PROFILE["entries"][0], PROFILE, 0) == 4.0
+
+
+def test_parse_speed():
+    assert parse_speed("1.5x") == 1.5
+    assert parse_speed(" 2 ") == 2.0
+    with pytest.raises(ValueError):
+        parse_speed("0x")
+
+
+@pytest.mark.parametrize("text, seconds", [("90m", 5400), ("2h", 7200), ("3600", 3600), ("1:30:00", 5400)])
+def test_parse_deadline(text, seconds):
+    assert parse_deadline(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["soon", "0m", "2w"])
+def test_parse_deadline_invalid(text):
+    with pytest.raises(ValueError):
+        parse_deadline(text)
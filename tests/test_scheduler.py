@@ -0,0 +1,39 @@
+from scheduler import plan_jobs, thread_args, useful_threads
+
+
+def test_explicit_jobs_without_heights():
+    assert plan_jobs([], 4, cores=16, count=10) == (4, 4)
+
+
+def test_explicit_jobs_capped_at_file_count():
+    assert plan_jobs([1080, 1080], 8, cores=16) == (2, 8)
+
+
+def test_empty_batch_plans_one_job():
+    assert plan_jobs([], None, cores=16) == (1, 16)
+
+
+def test_jobs_from_resolution():
+    # 720p keeps 8 threads busy, so 32 cores run 4 files at once
+    assert plan_jobs([720] * 10, None, cores=32) == (4, 8)
+    assert plan_jobs([2160] * 10, None, cores=32) == (1, 32)
+
+
+def test_count_covers_files_not_probed_yet():
+    assert plan_jobs([480], None, cores=16, count=8) == (4, 4)
+
+
+def test_useful_threads():
+    assert useful_threads(480) == 4
+    assert useful_threads(1000) == 16
+    assert useful_threads(0) == 32
+
+
+def test_single_job_keeps_x265_defaults():
+    assert thread_args(16, 1) == ([], [])
+    assert thread_args(8, 4) == (["-threads", "4"], ["-x265-params", "pools=8:frame-threads=2"])
+
+
+def test_explicit_jobs_for_an_open_ended_batch():
+    # Watch mode has no files up front, the count is the requested job count
+    assert plan_jobs([], 4, cores=16, count=4) == (4, 4)
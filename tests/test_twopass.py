@@ -0,0 +1,27 @@
+import os
+import sys
+from twopass import video_bitrate, resolve_command
+
+
+def info(duration, audio_bit_rate=0):
+    return {"duration": duration, "audio_bit_rate": audio_bit_rate, "audio_streams": 1 if audio_bit_rate else 0,
+            "bit_rate": 0, "video_bit_rate": 0}
+
+
+def test_video_bitrate_leaves_room_for_audio():
+    assert video_bitrate(info(100.0), 10_000_000) == 784
+    assert video_bitrate(info(100.0, 128_000), 10_000_000) == 656
+
+
+def test_video_bitrate_too_small_or_unknown():
+    assert video_bitrate(info(100.0), 100_000) is None
+    assert video_bitrate(info(0.0), 10_000_000) is None
+
+
+def test_resolve_command_makes_relative_paths_absolute():
+    assert resolve_command(os.path.join(".", "ffmpeg")) == os.path.abspath("ffmpeg")
+
+
+def test_resolve_command_searches_path():
+    assert os.path.isabs(resolve_command(os.path.basename(sys.executable)))
+    assert resolve_command("no-such-ffmpeg") == "no-such-ffmpeg"
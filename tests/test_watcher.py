@@ -0,0 +1,31 @@
+import asyncio
+from engine import CompressionEngine
+from scheduler import cpu_count
+from watcher import WatchDaemon, is_candidate
+
+
+def daemon(**kwargs):
+    return WatchDaemon(CompressionEngine(20, **kwargs), "in", "out", lambda path: path)
+
+
+def test_watch_uses_the_requested_job_count():
+    async def plan():
+        watch = daemon(jobs=4)
+        watch.plan()
+        return watch.engine.job_count, watch.engine.job_threads
+    assert asyncio.run(plan()) == (4, max(1, cpu_count() // 4))
+
+
+def test_watch_chunked_runs_one_file_at_a_time():
+    async def plan():
+        watch = daemon(jobs=4, chunked=True)
+        watch.plan()
+        return watch.engine.job_count
+    assert asyncio.run(plan()) == 1
+
+
+def test_is_candidate():
+    assert is_candidate("/in/clip.MKV")
+    assert not is_candidate("/in/clip_compressed.mp4")
+    assert not is_candidate("/in/.clip.mp4.partial")
+    assert not is_candidate("/in/notes.txt")
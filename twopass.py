@@ -0,0 +1,116 @@
+import os
+import shutil
+import hashlib
+from cache import cache_dir, file_key
+from progress import FFmpegProcess
+
+# Share of the target size kept free for the container
+MUX_OVERHEAD = 0.02
+MIN_VIDEO_KBPS = 32
+
+
+def audio_bytes(info):
+    bit_rate = info["audio_bit_rate"]
+    if not bit_rate and info["audio_streams"] and info["bit_rate"] and info["video_bit_rate"]:
+        bit_rate = max(0, info["bit_rate"] - info["video_bit_rate"])
+    return bit_rate * info["duration"] / 8
+
+
+def video_bitrate(info, target_bytes):
+    if not info["duration"]:
+        return None
+    video_bits = (target_bytes * (1 - MUX_OVERHEAD) - audio_bytes(info)) * 8
+    kbps = int(video_bits / info["duration"] / 1000)
+    return kbps if kbps >= MIN_VIDEO_KBPS else None
+
+
+def stats_name(input_file, preset):
+    digest = hashlib.sha1(f"{file_key(input_file)}|{preset}".encode()).hexdigest()[:20]
+    return f"{digest}.log"
+
+
+def resolve_command(command):
+    # ffmpeg runs with another working directory, so a relative path like ./ffmpeg must be made absolute
+    if os.path.dirname(command):
+        return os.path.abspath(command)
+    return shutil.which(command) or command
+
+
+class TwoPassEncoder:
+    def __init__(self, input_file, output_file, info, target_bytes, preset="slow", ffmpegcmd="ffmpeg",
+                 decode_args=(), x265_params="", log=None, progress=None, on_exit=None):
+        self.input_file = os.path.abspath(input_file)
+        self.output_file = os.path.abspath(output_file)
+        self.info = info
+        self.target_bytes = target_bytes
+        self.preset = preset
+        self.ffmpegcmd = resolve_command(ffmpegcmd)
+        self.decode_args = list(decode_args)
+        self.x265_params = x265_params
+        self.log = log or (lambda message: None)
+        self.progress = progress or (lambda current, total: None)
+        self.on_exit = on_exit
+        # x265 splits its params on ':' so the stats path can't hold a drive letter,
+        # ffmpeg runs inside the stats folder and gets a bare file name instead
+        self.stats_dir = os.path.join(cache_dir(), "twopass")
+        self.stats_file = stats_name(input_file, preset)
+        os.makedirs(self.stats_dir, exist_ok=True)
+
+    def stats_ready(self):
+        return all(os.path.exists(os.path.join(self.stats_dir, name)) for name in (self.stats_file, self.stats_file + ".cutree"))
+
+    def discard_stats(self):
+        for name in (self.stats_file, self.stats_file + ".cutree"):
+            try:
+                os.remove(os.path.join(self.stats_dir, name))
+            except OSError:
+                pass
+
+    def params(self, pass_number):
+        params = f"pass={pass_number}:stats={self.stats_file}"
+        return f"{self.x265_params}:{params}" if self.x265_params else params
+
+    async def run_pass(self, pass_number, kbps, offset, total):
+        output = ["-an", "-f", "null", os.devnull] if pass_number == 1 else ["-acodec", "copy", "-y", self.output_file]
+        command = [
+            self.ffmpegcmd, *self.decode_args, "-i", self.input_file,
+            "-vcodec", "libx265", "-b:v", f"{kbps}k", "-preset", self.preset, "-x265-params", self.params(pass_number),
+            *output
+        ]
+
+        def on_progress(event):
+            if self.info["frames"]:
+                self.progress(offset + min(event.frame, self.info["frames"]), total)
+
+        process = FFmpegProcess(command, on_progress, cwd=self.stats_dir, on_exit=self.on_exit)
+        if await process.run() != 0:
+            for line in process.tail():
+                self.log(f"  {line}")
+        return process.returncode
+
+    async def run(self):
+        kbps = video_bitrate(self.info, self.target_bytes)
+        if kbps is None:
+            self.log(f"Error: target size is too small (or duration unknown) for {self.input_file}.")
+            return False
+
+        frames = self.info["frames"]
+        offset = 0
+        total = frames
+        if self.stats_ready():
+            self.log(f"Reusing first pass stats for {self.input_file}, video bitrate {kbps} kbit/s")
+        else:
+            self.log(f"First pass for {self.input_file}, video bitrate {kbps} kbit/s")
+            total = frames * 2
+            if await self.run_pass(1, kbps, 0, total) != 0:
+                self.discard_stats()
+                self.log(f"Error: First pass failed for {self.input_file}.")
+                return False
+            offset = frames
+
+        self.log(f"Second pass for {self.input_file}")
+        if await self.run_pass(2, kbps, offset, total) != 0:
+            # Stale or mismatched stats make x265 bail out, don't keep them around
+            self.discard_stats()
+            return False
+        return True
@@ -0,0 +1,48 @@
+import os
+import json
+import time
+from cache import cache_dir, read_json, write_json_atomic
+
+RELEASES_URL = os.environ.get(
+    "KRRSNK_RELEASES_URL", "https://api.github.com/repos/kararasenok-gd/krrsnk-video-compressor/releases/latest"
+)
+RELEASES_PAGE = "https://github.com/kararasenok-gd/krrsnk-video-compressor/releases/latest"
+CHECK_TIMEOUT = 3.0
+CHECK_INTERVAL = 24 * 60 * 60
+
+
+def cache_path():
+    return os.path.join(cache_dir(), "update_check.json")
+
+
+def fetch_latest(url=RELEASES_URL, timeout=CHECK_TIMEOUT):
+    # Imported here, urllib.request pulls in ssl and http.client which slow down startup
+    import urllib.request
+    request = urllib.request.Request(url, headers={"Accept": "application/vnd.github+json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)["name"]
+
+
+def latest_release(url=RELEASES_URL, timeout=CHECK_TIMEOUT, max_age=CHECK_INTERVAL):
+    # Returns the name of the latest release, or None when it can't be found out.
+    # A successful answer is reused for max_age seconds, 0 always asks again.
+    cached = read_json(cache_path(), {})
+    if max_age and cached.get("url") == url and 0 <= time.time() - cached.get("checked", 0) < max_age:
+        return cached.get("latest")
+    try:
+        latest = fetch_latest(url, timeout)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    try:
+        write_json_atomic(cache_path(), {"url": url, "checked": time.time(), "latest": latest})
+    except OSError:
+        pass
+    return latest
+
+
+def is_latest(current_version, url=RELEASES_URL, timeout=CHECK_TIMEOUT, max_age=CHECK_INTERVAL):
+    # True or False, None when offline or the releases API didn't answer in time
+    latest = latest_release(url, timeout, max_age)
+    if latest is None:
+        return None
+    return latest == f"v{current_version}"
@@ -0,0 +1,241 @@
+import os
+import sys
+import struct
+import signal
+import asyncio
+import ctypes
+import ctypes.util
+from scheduler import plan_jobs, cpu_count
+
+SETTLE_SECONDS = 5.0
+POLL_SECONDS = 2.0
+QUEUE_SIZE = 64
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".m4v", ".mts", ".m2ts", ".webm", ".wmv", ".flv", ".3gp")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_candidate(path):
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    # Hidden files cover our own .partial outputs and most copy tools' temp files
+    return not name.startswith(".") and ext.lower() in VIDEO_EXTENSIONS and not stem.endswith("_compressed")
+
+
+def signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Inotify:
+    def __init__(self, folder):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder}")
+
+    def read(self):
+        # Returns the changed names and whether the kernel dropped events
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+        names, overflow, offset = [], False, 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            overflow = overflow or bool(mask & IN_Q_OVERFLOW)
+            if name:
+                names.append(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    def __init__(self, folder, on_ready, settle=SETTLE_SECONDS, poll=POLL_SECONDS, log=None):
+        self.folder = folder
+        self.on_ready = on_ready
+        self.settle = settle
+        self.poll = poll
+        self.log = log or (lambda message: None)
+        # path -> (size, mtime) and the time it was last seen changing
+        self.candidates = {}
+        # path -> signature it had when it was handed over, a replaced file is picked up again
+        self.handed = {}
+        self.inotify = None
+
+    def notice(self, path):
+        if not is_candidate(path) or path in self.candidates:
+            return
+        current = signature(path)
+        if current is None or self.handed.get(path) == current:
+            return
+        self.candidates[path] = (current, asyncio.get_running_loop().time())
+
+    def scan(self):
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError as e:
+            self.log(f"Error: can't read {self.folder}: {e}")
+            return
+        for entry in entries:
+            if entry.is_file():
+                self.notice(entry.path)
+
+    def on_inotify(self):
+        names, overflow = self.inotify.read()
+        if overflow:
+            self.scan()
+        for name in names:
+            path = os.path.join(self.folder, name)
+            if path in self.candidates:
+                # Still being written, restart its settle timer
+                self.candidates[path] = (signature(path), asyncio.get_running_loop().time())
+            else:
+                self.notice(path)
+
+    async def check_settled(self):
+        now = asyncio.get_running_loop().time()
+        ready = []
+        for path, (previous, since) in list(self.candidates.items()):
+            current = signature(path)
+            if current is None:
+                del self.candidates[path]
+            elif current != previous:
+                self.candidates[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.candidates[path]
+                ready.append((path, current))
+        for path, current in ready:
+            self.handed[path] = current
+            # Blocks while the work queue is full, that's the backpressure
+            await self.on_ready(path, current)
+
+    async def run(self, stopping):
+        loop = asyncio.get_running_loop()
+        try:
+            self.inotify = Inotify(self.folder)
+            loop.add_reader(self.inotify.fd, self.on_inotify)
+            self.log(f"Watching {self.folder} (inotify)")
+        except (OSError, AttributeError, NotImplementedError):
+            self.inotify = None
+            self.log(f"Watching {self.folder} (polling every {self.poll:g}s)")
+
+        self.scan()
+        try:
+            while not stopping.is_set():
+                try:
+                    await asyncio.wait_for(stopping.wait(), min(self.poll, self.settle))
+                except asyncio.TimeoutError:
+                    pass
+                if self.inotify is None:
+                    self.scan()
+                await self.check_settled()
+        finally:
+            if self.inotify:
+                loop.remove_reader(self.inotify.fd)
+                self.inotify.close()
+
+
+class WatchDaemon:
+    def __init__(self, engine, watch_folder, output_folder, output_path, queue_size=QUEUE_SIZE,
+                 settle=SETTLE_SECONDS, poll=POLL_SECONDS, log=None):
+        self.engine = engine
+        self.output_folder = output_folder
+        self.output_path = output_path
+        self.queue_size = queue_size
+        self.log = log or (lambda message: None)
+        self.watcher = FolderWatcher(watch_folder, self.enqueue, settle, poll, self.log)
+        self.in_flight = set()
+        self.sequence = 0
+
+    async def enqueue(self, path, current):
+        # Oldest file first, whatever order the scan or the events found them in
+        self.sequence += 1
+        await self.queue.put((current[1], self.sequence, path))
+
+    async def worker(self):
+        while True:
+            _, _, path = await self.queue.get()
+            output_file = self.output_path(path)
+            if self.engine.is_unchanged(path, output_file):
+                continue
+            job = self.engine.submit(path, output_file)
+            self.in_flight.add(job.task)
+            job.task.add_done_callback(self.in_flight.discard)
+            # Shielded so stopping the worker doesn't cancel the encode it started
+            await asyncio.shield(job.task)
+
+    def install_signals(self):
+        loop = asyncio.get_running_loop()
+
+        def on_signal(*args):
+            if not self.stopping.is_set():
+                self.stopping.set()
+            else:
+                self.log("Aborting the encodes in progress.")
+                for task in list(self.in_flight):
+                    task.cancel()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, on_signal)
+            except (NotImplementedError, RuntimeError):
+                # Windows, hand the signal over to the loop thread
+                signal.signal(signum, lambda *args: loop.call_soon_threadsafe(on_signal))
+
+    def plan(self):
+        # The engine was planned for an empty batch, size it for a stream of files that never ends
+        if self.engine.chunked:
+            self.engine.configure(1, cpu_count())
+        else:
+            self.engine.configure(*plan_jobs([], self.engine.jobs, count=self.engine.jobs or cpu_count()))
+
+    async def run(self):
+        self.queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self.stopping = asyncio.Event()
+        self.install_signals()
+        os.makedirs(self.output_folder, exist_ok=True)
+
+        # One worker per job slot, so ffprobe and ffmpeg only ever run for files that are being encoded
+        if self.engine.governor:
+            self.engine.governor.start(self.engine, self.output_folder)
+        # After the governor started, so the plan sees the CPUs it pins us to
+        self.plan()
+        if self.engine.job_count > 1:
+            self.log(f"Running {self.engine.job_count} compressions at once, {self.engine.job_threads} threads each")
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.engine.job_count)]
+        watcher = asyncio.create_task(self.watcher.run(self.stopping))
+        await self.stopping.wait()
+
+        self.log(f"Stopping: finishing {len(self.in_flight)} encode(s) in progress, press Ctrl+C again to abort them.")
+        watcher.cancel()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(watcher, *workers, return_exceptions=True)
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+        if self.engine.governor:
+            await self.engine.governor.stop()
+        if self.queue.qsize() or self.watcher.candidates:
+            self.log(f"{self.queue.qsize() + len(self.watcher.candidates)} file(s) left for the next run.")